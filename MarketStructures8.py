@@ -1,25 +1,41 @@
 import argparse
+import hashlib
 import json
 import logging
 import os
 import shutil
 import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta, timezone
 from typing import Any
 
+import numpy as np
 import pandas as pd
 import requests
 from pandas import DataFrame
 from requests import ReadTimeout
 
 import google_sheet_updater
+import http_client
+import polars_engine
 from ESI_OAUTH_FLOW import get_token
+from esi_decode import decode_orders, decode_history, to_pandas, order_columns
+from esi_governor import governor
+from esi_expiry import record_expiry, parse_expires, is_expired, next_expiry, orders_endpoint, history_endpoint
+from etag_cache import PageCache
+from fetch_journal import resume_or_start, mark_done, finish_run
 from file_cleanup import rename_move_and_archive_csv, push_updated_files
 from get_jita_prices import get_jita_prices
 from logging_tool import configure_logging
-from shared_utils import fill_missing_stats_v2, get_doctrine_status_optimized, get_doctrine_mkt_status
+from order_stats import sell_order_stats, order_book_stats, sell_ladder, depth_stats, weighted_quantiles
+from snapshot_archive import write_snapshot
+from shared_utils import fill_missing_stats_v2, get_doctrine_status_optimized, get_doctrine_mkt_status, \
+    read_history_means
 from sql_handler import process_esi_market_order_optimized, read_sql_watchlist, read_history, update_stats, \
-    update_doctrine_stats, market_data_to_brazil, insert_pd_type_names
+    update_doctrine_stats, market_data_to_brazil, insert_pd_type_names, begin_order_staging, stage_order_page, \
+    apply_staged_orders, read_sell_orders, read_book_orders, update_structure_orders, read_structure_sell_orders, \
+    update_structure_stats, update_history, read_history_progress, mark_history_checked, read_history_priority, \
+    read_order_changes, read_market_stats_state, save_market_stats_state, update_stats_rows, read_sql_market_stats
 # GNU General Public License
 #
 # ---------------------------------------------
@@ -32,16 +48,61 @@ from sql_handler import process_esi_market_order_optimized, read_sql_watchlist,
 os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
 
 # Currently set for the 4-HWWF Keepstar. You can enter another structure ID for a player-owned structure that you have access to.
+# This is the primary structure: its orders feed market_order, Market_Stats and the doctrine checks.
 structure_id = 1035466617946
 
+# more structures can be listed in data/market_structures.csv. they are fetched in the same run and
+# stored per structure (see fetch_structures)
+structures_filename = "data/market_structures.csv"
+
+
+# ESI root for both fetchers. set ESI_BASE_URL to point them at the local stand-in (esi_standin.py)
+ESI_BASE_URL = os.getenv("ESI_BASE_URL", "https://esi.evetech.net/latest").rstrip("/")
+# regional history is for Vale of the Silent
+REGION_ID = 10000003
+
+
+def structure_url(structure: int) -> str:
+    return f"{ESI_BASE_URL}/markets/structures/{structure}/?page="
+
+
+def history_url(region: int = REGION_ID) -> str:
+    return f"{ESI_BASE_URL}/markets/{region}/history/?datasource=tranquility&type_id="
+
+
 # set variables for ESI requests
-MARKET_STRUCTURE_URL = (
-    f"https://esi.evetech.net/latest/markets/structures/{structure_id}/?page="
-)
+MARKET_STRUCTURE_URL = structure_url(structure_id)
 SCOPE = [
     "esi-markets.structure_markets.v1"
 ]  # make sure you have this scope enabled in you ESI Dev Application settings.
 
+# number of order pages fetched at once. 1 fetches pages serially, like the original tool.
+PAGE_WORKERS = 8
+# number of history items fetched at once
+HISTORY_WORKERS = 8
+
+# incremental history refresh: how many days each tier may fall behind before it is fetched again.
+# doctrine items and items trading at least HOT_VOLUME units a day are hot, WARM_VOLUME and up warm.
+HISTORY_TIERS = {"hot": 0, "warm": 3, "cold": 7}
+HOT_VOLUME = 100
+WARM_VOLUME = 5
+# most history requests made by one incremental refresh. None = no limit
+HISTORY_BUDGET = 250
+
+# order book depth in the market stats: the average and marginal price of buying this many units
+# of each item, as avg_price_<N> and marginal_price_<N> (see order_stats.buy_cost)
+DEPTH_QUANTITIES = [50]
+# volume-weighted price percentiles in the market stats, as weighted_price_<q * 100>. Unlike
+# price_5th_percentile these count units, not orders (see order_stats.weighted_quantiles)
+WEIGHTED_QUANTILES = [0.05]
+
+# dataframe engines for the market stats stages, see polars_engine.py
+STATS_ENGINES = ["pandas", "polars"]
+
+# scheduler mode: seconds to wait past ESI's Expires time, and the shortest sleep between checks
+SCHEDULE_MARGIN = 5
+SCHEDULE_MIN_SLEEP = 30
+
 # output locations
 # You can change these file names to be more accurate when pulling data for other regions.
 orders_filename = (
@@ -59,6 +120,7 @@ market_stats_filename = (
 merged_sell_filename = (
     f"output/valemergedsell_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
 )
+errors_filename = "output/brazil/errors.json"
 master_history_filename = "data/masterhistory/valemarkethistory_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
 
 logger = configure_logging(log_name=__name__)
@@ -66,9 +128,87 @@ logger = configure_logging(log_name=__name__)
 # ===============================================
 # Functions: Fetch Market Structure Orders
 # -----------------------------------------------
-def fetch_market_orders():
+def fetch_order_page(page: int, headers: dict, url: str = MARKET_STRUCTURE_URL, etag: str | None = None) -> dict:
+    """Fetches a single page of structure orders through the ESI governor.
+
+    Retries, backoff and the error limit are handled by esi_governor. If an etag is given the
+    request is conditional, and a 304 comes back with not_modified set and no orders; the caller
+    fills them in from the page cache. The body is decoded straight into typed columns (see
+    esi_decode). Returns a dict with the orders frame (None if the page failed),
+    the X-Pages value, the ETag, the number of errors seen and the failed page record.
+    """
+    result = {"page": page, "orders": None, "count": None, "max_pages": None, "errors": 0, "failed": None,
+              "etag": None, "not_modified": False, "expires": None}
+
+    if etag is not None:
+        headers = {**headers, "If-None-Match": etag}
+
+    try:
+        response = governor.get(url + str(page), headers=headers, timeout=10)
+    except (ReadTimeout, requests.ConnectionError) as e:
+        logger.warning(f"Market API request failed: {e}")
+        result["errors"] += governor.max_retries + 1
+        result["failed"] = [page, type(e).__name__, str(e)]
+        return result
+
+    if "X-Pages" in response.headers:
+        result["max_pages"] = int(response.headers["X-Pages"])
+    elif response.status_code == 200:
+        result["max_pages"] = 1
+    logger.info(f"Got page {page}, status code {response.status_code}")
+
+    # every try before the last one was an error
+    result["errors"] += response.attempts - 1
+    result["etag"] = response.headers.get("ETag")
+    result["expires"] = response.headers.get("Expires")
+
+    if response.status_code == 304:
+        result["not_modified"] = True
+        result["etag"] = result["etag"] or etag
+        return result
+
+    if response.status_code != 200:
+        result["errors"] += 1
+        error_code = response.status_code
+        try:
+            error = response.json()["error"]
+        except (ValueError, KeyError, TypeError):
+            error = response.text
+        print(f"Giving up on page {page} after {response.attempts} tries.")
+        logger.error(
+            f"Giving up on page {page} after {response.attempts} tries. status code: {error_code}, details: {error}"
+        )
+        result["failed"] = [page, error_code, error]
+        return result
+
+    try:
+        result["orders"] = decode_orders(response.content)
+        logger.info(f"Fetched {len(result['orders'])} orders from page {page}.")
+    except ValueError:
+        logger.error(f"Error decoding JSON response from page {page}.")
+        result["failed"] = [page, "ValueError", "ValueError"]
+    return result
+
+
+def fetch_market_orders(workers: int = 1, url: str | None = None, token: dict | None = None,
+                        errors_file: str = errors_filename, use_cache: bool = True, stream: bool = False,
+                        resume: bool = False, structure: int = structure_id):
+    """Fetches every order page for the structure.
+
+    With stream=True each page is validated and written to the staging table as it arrives, and
+    at the end only the orders that changed are applied to market_order (see
+    sql_handler.apply_staged_orders), so only a few pages are ever held in memory. The number
+    of orders loaded is returned. Otherwise the orders are returned as a DataFrame.
+    Either way they come back as (orders, error_dict), error_dict being the fetch report that is
+    also saved to errors_file (failed_pages_count, total_pages, ...).
+    Streamed pages are checkpointed in the fetch journal; resume=True carries on from the last
+    unfinished run and keeps the pages it already staged.
+    Streaming is only for the primary structure; other structures are fetched as a DataFrame.
+    """
+    url = url or structure_url(structure)
     # initiates the oath2 flow
-    token = get_token(SCOPE)
+    if token is None:
+        token = get_token(SCOPE)
     print("ESI Scope Authorized. Requesting data.")
     print("-----------------------------------------")
 
@@ -78,106 +218,126 @@ def fetch_market_orders():
         "User-Agent": "WC Markets 0.52 (admin contact: Orthel.Toralen@gmail.com; +https://github.com/OrthelT/ESIMarket_Tool",
     }
 
-    page = 1
     max_pages = 1
-    tries = 0
     error_count = 0
     total_pages = 0
-    all_orders = []
+    orders_retrieved = 0
+    order_frames = []
     failed_pages = []
     failed_pages_count = 0
     errors_detected = 0
-    logger.info("-----START FETCH MARKET ORDERS-----")
+    logger.info(f"-----START FETCH MARKET ORDERS {structure}-----")
+    logger.info(f"fetching with {workers} worker(s)")
     logger.info("-"*60)
 
-    while page <= max_pages:
-        try:
-            response = requests.get(MARKET_STRUCTURE_URL + str(page), headers=headers, timeout=10)
-            if "X-Pages" in response.headers:
-                max_pages = int(response.headers["X-Pages"])
-                logger.info(f"Max pages: {max_pages}...")
-            elif response.status_code == 200:
-                max_pages = 1
-
-            logger.info(f"Got page {page} of {max_pages}")
-            status_code = response.status_code
-            logger.info(f"status code {status_code}")
-
-            page_ratio: float = page / max_pages
-            page_ratio_rounded: int = round(page_ratio * 100)
-            page_ratio_rounded_str: str = str(page_ratio_rounded) + "%"
-            print(f"\rFetching market order pages pages {page_ratio_rounded_str}. Page: {page}", end="")
-            logger.info(f"fetching market orders page {page} of {max_pages} pages...")
-            # make sure we don't hit the error limit and get our IP banned
-            errorsleft = int(response.headers.get("X-ESI-Error-Limit-Remain", 0))
-            errorreset = int(response.headers.get("X-ESI-Error-Limit-Reset", 0))
-
-        except ReadTimeout as e:
-            logger.warning(f"Market API request timed out: {e}")
-            error_count += 1
-            errors_detected += 1
-            continue
-
-        if errorsleft == 0:
-            break
-        elif errorsleft < 10:
-            print(
-                f"WARNING: Errors remaining: {errorsleft}. Error limit reset: {errorreset} seconds."
-            )
-            logger.error(f"Errors remaining: {errorsleft}. Error limit reset: {errorreset}")
-
-        # some error handling to gently keep prodding the ESI until we gat all the data
-        if response.status_code != 200:
-            errors_detected += 1
-            error_count += 1
-
-            error_code = response.status_code
-            logger.error(f"Error detected: {errors_detected} status code: {error_code}")
-
-            error_details = response.json()
-            error = error_details["error"]
-            logger.error(
-                f"Error fetching data from page {page}. status code: {error_code}, details: {error}"
-            )
-
-            if tries < 5:
-                logger.error(f"error: {error_count}")
-                tries += 1
-                time.sleep(3)
-                continue
-            else:
-                print(f"Reached the 5th try and giving up on page {page}.")
-                logger.error(f"Reached the 5th try and giving up on page {page}.")
-                failed_pages.append([page, error_code, error])
-                failed_pages_count += 1
-                page += 1
-                tries = 0
-                continue
-        else:
-            tries = 0
+    # pages that haven't changed since the last run come back as 304 and are read from the cache
+    cache = PageCache() if use_cache else None
+    etags = cache.etags(structure) if cache else {}
+
+    def resolve_cache(result: dict) -> dict:
+        # runs on the main thread so only one thread ever writes to the cache
+        if cache is None or result["failed"] is not None:
+            return result
+        page = result["page"]
+        if result["not_modified"]:
+            cached = cache.load(structure, page)
+            if cached is None:
+                logger.warning(f"page {page} not modified but missing from cache, fetching it again")
+                return resolve_cache(fetch_order_page(page, headers, url))
+            result["orders"], cached_pages = cached
+            if isinstance(result["orders"], list):
+                # cached before pages were decoded into columns
+                result["orders"] = decode_orders(json.dumps(result["orders"]))
+            result["max_pages"] = result["max_pages"] or cached_pages
+            cache.record(hit=True)
+        elif result["orders"] is not None:
+            cache.record(hit=False)
+            if result["etag"]:
+                cache.store(structure, page, result["etag"], result["max_pages"], result["orders"])
+        return result
+
+    run_ts = datetime.now(timezone.utc)
+    run_id, done_pages = resume_or_start("orders", resume) if stream else (None, {})
+    engine = begin_order_staging(reset=not done_pages) if stream else None
+
+    def collect(result: dict) -> dict:
+        # runs on the main thread. in stream mode the page goes to the staging table and is
+        # dropped from memory straight away
+        result = resolve_cache(result)
+        if result["orders"] is not None:
+            result["count"] = len(result["orders"])
+            if stream:
+                if result["page"] in done_pages:
+                    # staged before the interruption, page 1 is only refetched for X-Pages
+                    result["count"] = done_pages[result["page"]]
+                else:
+                    stage_order_page(result["orders"], run_ts, engine)
+                    mark_done(run_id, result["page"], result["count"])
+                result["orders"] = None
+        return result
+
+    # page 1 tells us how many pages there are; the rest can be fetched in any order
+    results = {}
+    first = collect(fetch_order_page(1, headers, url, etags.get(1)))
+    results[1] = first
+    if first["max_pages"]:
+        max_pages = first["max_pages"]
+        logger.info(f"Max pages: {max_pages}...")
+
+    remaining = [page for page in range(2, max_pages + 1) if page not in done_pages]
+    done = 1 + (max_pages - 1 - len(remaining))
+
+    def report_progress(page: int):
+        page_ratio_rounded_str: str = str(round(done / max_pages * 100)) + "%"
+        print(f"\rFetching market order pages pages {page_ratio_rounded_str}. Page: {page}", end="")
+        logger.info(f"fetched market orders page {page} ({done} of {max_pages} pages)...")
+
+    report_progress(1)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(fetch_order_page, page, headers, url, etags.get(page)) for page in remaining]
+            for future in as_completed(futures):
+                result = collect(future.result())
+                results[result["page"]] = result
+                done += 1
+                report_progress(result["page"])
+    else:
+        for page in remaining:
+            result = collect(fetch_order_page(page, headers, url, etags.get(page)))
+            results[page] = result
+            done += 1
+            report_progress(page)
+            if result["count"] == 0:
+                break
+
+    # pages staged by the interrupted run count towards this one
+    for page, count in done_pages.items():
+        if page not in results and page <= max_pages:
+            results[page] = {"page": page, "orders": None, "count": count, "errors": 0, "failed": None}
+
+    # assemble in page order so the output matches a serial fetch
+    for page in sorted(results):
+        result = results[page]
+        error_count += result["errors"]
+        errors_detected += result["errors"]
+        if result["failed"] is not None:
+            failed_pages.append(result["failed"])
+            failed_pages_count += 1
+        elif result["count"] is not None:
             total_pages += 1
-            try:
-                orders = response.json()
-                logger.info(f"Fetched {len(orders)} orders from page {page}.")
-            except ValueError:
-                logger.error(f"Error decoding JSON response from page {page}.")
-                failed_pages.append([page, "ValueError", "ValueError"])
-                failed_pages_count += 1
-                continue
-        page += 1
+            orders_retrieved += result["count"]
+            if result["count"] == 0:
+                logger.error(f"No orders found in page {page}.")
+            if not stream:
+                order_frames.append(result["orders"])
 
-        if not orders:
-            logger.error(f"No orders found in page {page}.")
-            break
-
-        all_orders.extend(orders)
     error_dict = {}
     if failed_pages_count > 0:
         print(f"The following pages failed: {failed_pages}")
         logger.error(f'The following pages failed: {failed_pages}')
         print(f"{failed_pages_count} pages failed.")
 
-        logger.error(print("{failed_pages_count} pages failed."))
+        logger.error(f"{failed_pages_count} pages failed.")
     elif errors_detected > 0:
         print(f'All {total_pages} of {max_pages} pages fetched, but {errors_detected} errors detected.')
         logger.warning(f"{total_pages} of {max_pages} pages fetched. but {errors_detected} errors detected.")
@@ -187,7 +347,7 @@ def fetch_market_orders():
         logger.info(f'All pages fetched successfully.')
 
     logger.info(
-        f"done. retrieved {len(all_orders)}...")
+        f"done. retrieved {orders_retrieved}...")
     if error_count > 0:
         logger.error(f"There were {error_count} errors.")
 
@@ -196,18 +356,153 @@ def fetch_market_orders():
     error_dict['failed_pages_count'] = failed_pages_count
     error_dict['max_pages'] = max_pages
     error_dict['errors_detected'] = errors_detected
-    error_dict['orders_retrieved'] = len(all_orders)
+    error_dict['orders_retrieved'] = orders_retrieved
     error_dict['timestamp'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    with open('output/brazil/errors.json', 'w') as errors_file:
-        json.dump(error_dict, errors_file)
+
+    # remember when ESI will have new orders. a partial fetch is retried on the next run instead
+    if failed_pages_count == 0:
+        record_expiry(orders_endpoint(structure), first["expires"])
+    if cache is not None:
+        error_dict.update(cache.stats())
+        print(f"page cache: {cache.hits} hits, {cache.misses} misses")
+        logger.info(f"page cache: {cache.hits} hits (304, reused), {cache.misses} misses (downloaded)")
+    with open(errors_file, 'w') as f:
+        json.dump(error_dict, f)
+
+    if stream:
+        if orders_retrieved > 0:
+            # only the orders that changed since the last run are written to market_order
+            changes = apply_staged_orders(engine, complete=failed_pages_count == 0)
+            logger.info(changes["status"])
+        else:
+            logger.error("no orders retrieved, keeping the existing market_order table")
+        finish_run(run_id)
 
     logger.info("-----END FETCH MARKET ORDERS-----")
     logger.info("-"*60)
-    return all_orders
+    orders = orders_retrieved if stream else to_pandas(order_frames, order_columns)
+    return orders, error_dict
+
+
+def read_market_structures(path: str = structures_filename) -> pd.DataFrame:
+    # the structures to fetch, always including the primary one
+    if os.path.exists(path):
+        structures = pd.read_csv(path)
+    else:
+        structures = pd.DataFrame(columns=["structure_id", "structure_name"])
+    structures["structure_id"] = structures["structure_id"].astype("int64")
+    if structure_id not in structures["structure_id"].values:
+        primary = pd.DataFrame({"structure_id": [structure_id], "structure_name": ["primary"]})
+        structures = pd.concat([primary, structures], ignore_index=True)
+    return structures.drop_duplicates("structure_id").reset_index(drop=True)
+
+
+def fetch_structures(structures: pd.DataFrame, workers: int = PAGE_WORKERS, use_cache: bool = True,
+                     refresh_primary: bool = True, resume: bool = False) -> dict:
+    """Fetches orders for every configured structure at once, under one token.
+
+    The primary structure is streamed into market_order as before. The others are fetched when
+    their ESI cache has expired and saved to structure_orders. All requests share the process-wide
+    governor, so the error limit and rate are shared too. Returns {structure_id: orders fetched}.
+    """
+    due = []
+    for sid in structures["structure_id"]:
+        sid = int(sid)
+        if sid == structure_id and refresh_primary or sid != structure_id and is_expired(orders_endpoint(sid)):
+            due.append(sid)
+        else:
+            logger.info(f"orders for structure {sid} not expired, keeping saved orders")
+    if not due:
+        return {}
+
+    token = get_token(SCOPE)
+    jobs = {}
+    with ThreadPoolExecutor(max_workers=len(due)) as executor:
+        for sid in due:
+            if sid == structure_id:
+                jobs[executor.submit(fetch_market_orders, workers, token=token, use_cache=use_cache,
+                                     stream=True, resume=resume)] = sid
+            else:
+                jobs[executor.submit(fetch_market_orders, workers, token=token, use_cache=use_cache,
+                                     errors_file=f"output/brazil/errors_{sid}.json", structure=sid)] = sid
+
+        counts = {}
+        for future in as_completed(jobs):
+            sid = jobs[future]
+            try:
+                orders, error_dict = future.result()
+            except Exception as e:
+                logger.error(f"failed to fetch orders for structure {sid}: {e}")
+                if sid == structure_id:
+                    raise
+                # a secondary structure failing shouldn't stop the run
+                continue
+            if sid == structure_id:
+                counts[sid] = orders
+                continue
+            counts[sid] = len(orders)
+            if len(orders) == 0:
+                logger.error(f"no orders retrieved for structure {sid}, keeping saved orders")
+                continue
+            complete = error_dict["failed_pages_count"] == 0
+            logger.info(update_structure_orders(sid, orders, complete=complete))
+    return counts
+
+def fetch_history_item(item: int, headers: dict, url: str) -> dict:
+    """Fetches and decodes the regional history for one type_id through the ESI governor.
+
+    Safe to run in a worker thread; journaling and progress are left to the caller. Returns a dict
+    with the decoded frame (None if the item failed), the raw body for the journal, the number of
+    errors seen, the Expires header and the time the item took, retries included.
+    """
+    result = {"type_id": item, "data": None, "body": None, "errors": 0, "expires": None, "seconds": None}
+    start = time.perf_counter()
+
+    # retries, backoff and the ESI error limit are handled by the governor
+    try:
+        response = governor.get(url + str(item), headers=headers, timeout=10)
+    except (ReadTimeout, requests.ConnectionError) as e:
+        # the governor only raises once every try has failed, counted like fetch_order_page does
+        result["errors"] += governor.max_retries + 1
+        logger.error(f"Request failed for item {item}: {e}. Moving on to the next...")
+        return result
+    finally:
+        result["seconds"] = time.perf_counter() - start
+
+    result["errors"] += response.attempts - 1
+    if response.status_code != 200:
+        result["errors"] += 1
+        logger.info(f"Unable to retrieve any data for {item} (status {response.status_code}). Moving on to the next...")
+        return result
+
+    # decoded straight into columns, with type_id added as a column
+    try:
+        result["data"] = decode_history(response.content, item)
+    except ValueError as e:
+        result["errors"] += 1
+        logger.error(f"{e}. Moving on to the next...")
+        return result
+    result["body"] = response.text
+    result["expires"] = parse_expires(response.headers.get("Expires"))
+    return result
+
+
+def latency_percentiles(seconds: list[float]) -> dict:
+    # p50/p90/p99/max in milliseconds
+    if not seconds:
+        return {}
+    p50, p90, p99 = np.percentile(seconds, [50, 90, 99]) * 1000
+    return {"p50_ms": round(p50), "p90_ms": round(p90), "p99_ms": round(p99), "max_ms": round(max(seconds) * 1000)}
+
 
 # update market history
-def fetch_market_history(fresh_data: bool = True, id_list: list[Any] | None = None) -> tuple[
-    DataFrame, list[Any] | None]:
+def fetch_market_history(fresh_data: bool = True, id_list: list[Any] | None = None, resume: bool = False,
+                         url: str | None = None, workers: int = HISTORY_WORKERS) -> tuple[DataFrame, DataFrame | None]:
+    """Fetches 30+ days of regional history for the watchlist, or reads the saved history.
+
+    Items are fetched by a pool of `workers` threads (1 = one at a time); the governor keeps the
+    total request rate and error budget in check. Every item is journaled as it completes.
+    """
     if id_list is None:
         watchlist = read_sql_watchlist()
         type_id_list = watchlist["type_id"].unique().tolist()
@@ -221,86 +516,81 @@ def fetch_market_history(fresh_data: bool = True, id_list: list[Any] | None = No
 
     if fresh_data:
         logging.info('fetching fresh data from ESI')
-        timeout = 10
-        market_history_url = "https://esi.evetech.net/latest/markets/10000003/history/?datasource=tranquility&type_id="
+        market_history_url = url or history_url()
 
         headers = {
             "Content-Type": "application/json",
             "User-Agent": "WC Markets 0.52 (admin contact: Orthel.Toralen@gmail.com; +https://github.com/OrthelT/ESIMarket_Tool",
         }
-        all_history = []
-        page = 1
-        max_pages = 1
+        history_frames = []
         errorcount = 0
-        tries = 0
         successful_returns = 0
-
-        logger.info('fetching market history for 4-HWWF')
-        # Iterate over watchlist to fetch market history for 4-HWWF
-
+        history_expires = None
+        latencies = []
+
+        # every item is checkpointed, so an interrupted fetch can carry on with --resume
+        run_id, done_items = resume_or_start("history", resume)
+        for item, body in done_items.items():
+            # journaled as the raw response body
+            history_frames.append(decode_history(body if isinstance(body, str) else json.dumps(body), item))
+        successful_returns = len(done_items)
+        answered = list(done_items)
+
+        logger.info(f'fetching market history for 4-HWWF with {workers} worker(s)')
         total_items = len(type_id_list)
-
-        for type_id in range(total_items):
-            while page <= max_pages:
-                item = type_id_list[type_id]
-                type_name = type_id_to_name_map.get(item)
-
-                try:
-                    response = requests.get(
-                        market_history_url + str(item), headers=headers, timeout=timeout)
-
-                    item_ratio: float = successful_returns / total_items
-                    item_ratio_rounded: int = round(item_ratio * 100)
-                    item_ratio_rounded_str: str = str(item_ratio_rounded) + "%"
-                    print(f"\rFetching history {item_ratio_rounded_str} :: ({item} - {type_name})", end="")
-
-                    page += 1
-
-                    if "X-Pages" in response.headers:
-                        max_pages = int(response.headers["X-Pages"])
-                    else:
-                        max_pages = 1
-
-                    if response.status_code != 200:
-                        logging.error("error detected, retrying in 3 seconds...")
-                        time.sleep(3)
-                        errorcount += 1
-                        if tries < 5:
-                            tries += 1
-                            continue
-                        elif tries == 5:
-                            logger.info(
-                                f"Unable to retrieve any data for {item}. Moving on to the next..."
-                            )
-                            page = 1
-                            break
-
-                    data = response.json()
-
-                    if data:
-                        # Append the type_id to each item in the response
-                        for entry in data:
-                            entry["type_id"] = item  # Add type_id to each record
-                        all_history.extend(data)
-                    else:
-                        logging.info(f"Empty response for type_id {item}. Skipping.")
-
-                    successful_returns += 1
-                    tries = 0
-                    max_pages = 1
-
-                except ReadTimeout:
-                    logging.info(
-                        f"Request timed out for page {page}, item {item}. Retrying..."
-                    )
-                    if tries < 5:
-                        tries += 1
-                        time.sleep(3)  # Wait before retrying
-                        continue
-            page = 1
-            max_pages = 1
-
-        historical_df: DataFrame = pd.DataFrame(all_history)
+        remaining = [item for item in type_id_list if item not in done_items]
+        finished = total_items - len(remaining)
+
+        def collect(result: dict):
+            # runs on the main thread, so the journal and the progress line have one writer
+            nonlocal errorcount, successful_returns, history_expires, finished
+            item = result["type_id"]
+            finished += 1
+            errorcount += result["errors"]
+            latencies.append(result["seconds"])
+
+            item_ratio_rounded_str: str = str(round(finished / total_items * 100)) + "%"
+            print(f"\rFetching history {item_ratio_rounded_str} :: ({item} - {type_id_to_name_map.get(item)})", end="")
+
+            data = result["data"]
+            if data is None:
+                return
+            if data.height:
+                history_frames.append(data)
+            else:
+                logging.info(f"Empty response for type_id {item}. Skipping.")
+
+            mark_done(run_id, item, result["body"])
+            answered.append(item)
+            successful_returns += 1
+            expires = result["expires"]
+            if expires is not None and (history_expires is None or expires > history_expires):
+                history_expires = expires
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(fetch_history_item, item, headers, market_history_url) for item in remaining]
+                for future in as_completed(futures):
+                    collect(future.result())
+        else:
+            for item in remaining:
+                collect(fetch_history_item(item, headers, market_history_url))
+
+        print()
+        percentiles = latency_percentiles(latencies)
+        if percentiles:
+            print(f"history latency per item: {percentiles}")
+            logger.info(f"history: {len(latencies)} items fetched, latency per item {percentiles}")
+        if errorcount > 0:
+            logger.warning(f"{errorcount} errors while fetching history for {total_items} items.")
+        if successful_returns > 0:
+            record_expiry(history_endpoint(), history_expires)
+        finish_run(run_id)
+
+        historical_df: DataFrame = to_pandas(history_frames)
+        # the items ESI answered for, including ones with no trades
+        historical_df.attrs["answered"] = answered
+        all_history = historical_df
 
     else:
         logger.info('retrieving cached market history data')
@@ -311,42 +601,145 @@ def fetch_market_history(fresh_data: bool = True, id_list: list[Any] | None = No
     logger.info("returning history_df")
 
     return historical_df, all_history
+
+
+def latest_history_day(now: datetime | None = None) -> date:
+    # the newest day ESI has history for: yesterday, once the 11:00 UTC downtime has passed
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(hours=11, minutes=5)).date() - timedelta(days=1)
+
+
+def plan_history_refresh(type_ids: list, progress: dict, latest: date, budget: int | None = HISTORY_BUDGET) -> list:
+    """Picks which items to refresh this run, most important first, up to the request budget.
+
+    Items are tiered by doctrine use and avg_daily_volume (see HISTORY_TIERS). An item is due once
+    it is further behind than its tier allows; items with no history at all are always due and
+    go first, then doctrine items, then the busiest. Due items over the budget wait for a later run.
+    """
+    priority = read_history_priority().set_index("type_id")
+    plan = []
+    tiers = {tier: 0 for tier in HISTORY_TIERS}
+    for type_id in type_ids:
+        type_id = int(type_id)
+        volume = float(priority["avg_daily_volume"].get(type_id, 0))
+        doctrine_qty = float(priority["doctrine_qty"].get(type_id, 0))
+        if doctrine_qty > 0 or volume >= HOT_VOLUME:
+            tier = "hot"
+        elif volume >= WARM_VOLUME:
+            tier = "warm"
+        else:
+            tier = "cold"
+
+        known = progress.get(type_id)
+        days_behind = None if known is None else (latest - known).days
+        if days_behind is not None and days_behind <= HISTORY_TIERS[tier]:
+            continue
+        tiers[tier] += 1
+        plan.append((days_behind is not None, doctrine_qty == 0, -volume, -(days_behind or 0), type_id))
+
+    plan.sort()
+    due = [item[-1] for item in plan]
+    logger.info(f"history refresh due: {tiers}, budget {budget}")
+    if budget is not None and len(due) > budget:
+        logger.info(f"{len(due) - budget} due items deferred to a later run")
+        due = due[:budget]
+    return due
+
+
+def update_history_incremental(resume: bool = False, workers: int = HISTORY_WORKERS,
+                               budget: int | None = HISTORY_BUDGET) -> DataFrame:
+    """Fetches history only for watchlist items that are due, and adds just the new days.
+
+    An item is behind if neither its newest stored row nor its last check reaches the newest day
+    ESI has; plan_history_refresh decides which of those are fetched this run. Returns the last 30
+    days of history from the database, like quick mode.
+    """
+    type_ids = read_sql_watchlist()["type_id"].unique().tolist()
+    latest = latest_history_day()
+    progress = read_history_progress()
+    behind = plan_history_refresh(type_ids, progress, latest, budget)
+
+    print(f"history: fetching {len(behind)} of {len(type_ids)} items (newest ESI day {latest})")
+    logger.info(f"incremental history: fetching {len(behind)} of {len(type_ids)} items, newest ESI day {latest}")
+
+    changed = []
+    if behind:
+        fetched, _ = fetch_market_history(True, id_list=behind, resume=resume, workers=workers)
+        answered = fetched.attrs.get("answered", [])
+        if len(fetched):
+            fetched["date"] = pd.to_datetime(fetched["date"])
+            # keep only days newer than what is stored
+            known = fetched["type_id"].astype(int).map(progress)
+            known = pd.to_datetime(known)
+            new_rows = fetched[known.isna() | (fetched["date"] > known)]
+            logger.info(update_history(new_rows) if len(new_rows) else "no new history rows")
+            changed = new_rows["type_id"].astype(int).unique().tolist()
+        # items that answered are complete through the latest day, even if they didn't trade
+        mark_history_checked(answered, latest)
+
+    history = read_history(30)
+    # items with new history rows, for the incremental stats update
+    history.attrs["changed"] = changed
+    return history
+
 # ===============================================
 # Functions: Process Market Stats
 # -----------------------------------------------
-def aggregate_sell_orders(market_orders_json: any) -> pd.DataFrame:
+def aggregate_sell_orders(market_orders_json: any = None, type_ids: list | None = None) -> pd.DataFrame:
+    # with no orders passed in, the watchlist orders are read from the market_order table.
+    # type_ids limits the stats to those watchlist items. Buy orders only feed the bid columns
     logger.info("aggregating sell orders | aggregate_sell_orders()")
-    orders = pd.DataFrame(market_orders_json)
 
     ids = read_sql_watchlist()
     ids = ids["type_id"].tolist()
+    if type_ids is not None:
+        wanted = set(type_ids)
+        ids = [type_id for type_id in ids if type_id in wanted]
 
-    filtered_orders = orders[orders["type_id"].isin(ids)]
+    if market_orders_json is None:
+        filtered_orders = read_book_orders(ids)
+    else:
+        orders = pd.DataFrame(market_orders_json)
+        filtered_orders = orders[orders["type_id"].isin(ids)]
     sell_orders = filtered_orders[filtered_orders["is_buy_order"] == False]
 
     logger.info(f'filtered orders: {len(filtered_orders)} | aggregate_sell_orders()')
     logger.info(f'sell orders: {len(sell_orders)} | aggregate_sell_orders()')
     logger.info("aggregating orders | aggregate_sell_orders")
 
-    grouped_df = sell_orders.groupby("type_id")["volume_remain"].sum().reset_index()
-    grouped_df.columns = ["type_id", "total_volume_remain"]
-    min_price_df = sell_orders.groupby("type_id")["price"].min().reset_index()
-    min_price_df.columns = ["type_id", "min_price"]
-    percentile_5th_df = (
-        sell_orders.groupby("type_id")["price"].quantile(0.05).reset_index()
-    )
-    percentile_5th_df.columns = ["type_id", "price_5th_percentile"]
-    merged_df = pd.merge(grouped_df, min_price_df, on="type_id")
-    merged_df = pd.merge(merged_df, percentile_5th_df, on="type_id")
-    logger.info("successfully merged dataframes and completed aggregation | aggregate_sell_orders()")
+    # one sorted pass over both sides of the book for all the stats, see order_stats.py
+    merged_df = order_book_stats(filtered_orders)
+    merged_df = merged_df.merge(ladder_stats(sell_orders), on="type_id", how="left")
+    logger.info("successfully completed aggregation | aggregate_sell_orders()")
     logger.info(f"returning merged dataframe with {len(merged_df)} rows | aggregate_sell_orders()")
 
     return merged_df
 
-def merge_market_stats(merged_orders: pd.DataFrame, history_data: pd.DataFrame):
+def ladder_stats(sell_orders: pd.DataFrame) -> pd.DataFrame:
+    # order book depth and volume-weighted percentiles per type, both read off one sell ladder
+    ladder = sell_ladder(sell_orders)
+    depth = depth_stats(sell_orders, DEPTH_QUANTITIES, ladder)
+    return depth.merge(weighted_quantiles(sell_orders, WEIGHTED_QUANTILES, ladder), on="type_id", how="left")
+
+def aggregate_structure_stats(structures: pd.DataFrame) -> pd.DataFrame:
+    # sell order stats per (structure_id, type_id) across every structure, for the watchlist items
+    logger.info("aggregating sell orders per structure | aggregate_structure_stats()")
+    ids = watchlist["type_id"].tolist()
+
+    primary = read_sell_orders(ids)
+    primary.insert(0, "structure_id", structure_id)
+    sell_orders = pd.concat([primary, read_structure_sell_orders(ids)], ignore_index=True)
+
+    stats = sell_order_stats(sell_orders, by=["structure_id", "type_id"])
+
+    stats = stats.merge(structures[["structure_id", "structure_name"]], on="structure_id", how="left")
+    stats = stats.merge(watchlist[["type_id", "type_name"]], on="type_id", how="left")
+    logger.info(f"{len(stats)} rows for {stats['structure_id'].nunique()} structures | aggregate_structure_stats()")
+    return stats
+
+def merge_market_stats(merged_orders: pd.DataFrame):
     logger.info("merging historical data | merge_market_stats()")
-    grouped_historical_df = history_merge(history_data)
-    grouped_historical_df['type_id'] = grouped_historical_df['type_id'].astype('int64')
+    grouped_historical_df = history_merge()
 
     merged_data = pd.merge(
         merged_orders, grouped_historical_df, on="type_id", how="left"
@@ -356,32 +749,18 @@ def merge_market_stats(merged_orders: pd.DataFrame, history_data: pd.DataFrame):
     final_df = pd.merge(merged_data, watchlist, on="type_id", how="left")
 
     logger.info('calculating days remaining | merge_market_stats()')
-    final_df["days_remaining"] = final_df.apply(
-        lambda row: 0 if row["avg_daily_volume"] == 0 else row["total_volume_remain"] / row["avg_daily_volume"],
-        axis=1
-    )
+    # 0 when nothing trades, NaN when there's no history
+    avg_daily_volume = final_df["avg_daily_volume"]
+    final_df["days_remaining"] = (final_df["total_volume_remain"] / avg_daily_volume).where(avg_daily_volume != 0, 0)
 
     final_df["days_remaining"] = final_df["days_remaining"].round(1)
     logger.info('merge finished. returning final_df')
     return final_df
 
-def history_merge(history_data: pd.DataFrame) -> pd.DataFrame:
+def history_merge() -> pd.DataFrame:
+    # 30 day averages per type, from the history_rollup table that follows market_history
     logger.info("processing historical data")
-    historical_df = history_data
-
-    historical_df["date"] = pd.to_datetime(historical_df["date"], errors="coerce")
-
-    last_30_days_df = historical_df[
-        historical_df["date"] >= pd.to_datetime("today") - pd.DateOffset(days=30)
-        ]
-    grouped_historical_df = (
-        last_30_days_df.groupby("type_id")
-        .agg(
-            avg_of_avg_price=("average", "mean"),
-            avg_daily_volume=("volume", "mean"),
-        )
-        .reset_index()
-    )
+    grouped_historical_df = read_history_means()
     grouped_historical_df["avg_of_avg_price"] = grouped_historical_df[
         "avg_of_avg_price"
     ].round(2)
@@ -408,19 +787,115 @@ def update_doctrine_status(target: int = 20):
 
     logger.info(print("Completed doctrines check | update_doctrine_status()"))
 
-def process_orders(market_orders, history_data) -> tuple[DataFrame, DataFrame]:
-    logger.info("aggregating sell orders | process_orders()")
-    merged_sell_orders = aggregate_sell_orders(market_orders)
+def polars_market_stats(market_orders) -> tuple[DataFrame, DataFrame]:
+    # aggregate_sell_orders + merge_market_stats (and the history lookups of fill_missing_stats_v2)
+    # on the polars engine. Returns the stats and the rows for items without sell orders
+    ids = watchlist["type_id"].tolist()
+    if market_orders is None:
+        orders = read_book_orders(ids)
+    else:
+        orders = pd.DataFrame(market_orders)
+    orders = orders[orders["type_id"].isin(ids)]
+    extra = ladder_stats(orders[orders["is_buy_order"] == False])
+    return polars_engine.market_stats(orders, read_history_means(), watchlist, ids, extra)
+
+def plan_stats_update(history_changed: list | None) -> dict:
+    """Works out which Market_Stats rows need recomputing this run.
+
+    Those are the items with order changes logged since the last stats update, plus
+    history_changed (items with new history rows; None if the history was fully refreshed).
+    Everything is recomputed if there is no record of the last update, the watchlist changed,
+    the 30 day history window moved to a new day, market_order was replaced wholesale or the
+    history was fully refreshed. Returns {"type_ids": list, or None for a full recompute,
+    "state": what to record once the stats are saved}.
+    """
+    previous = read_market_stats_state()
+    changes = read_order_changes(previous["order_changes"] if previous else None)
+    state = {
+        "watchlist": hashlib.md5(watchlist.to_csv(index=False).encode()).hexdigest(),
+        # history_merge's 30 day cutoff, which only moves a whole day at a time
+        "history_window": (datetime.now() - timedelta(days=30)).date().isoformat(),
+        "order_changes": changes["latest"],
+    }
 
-    logger.info("merging historical data | process_orders()")
-    final_data = merge_market_stats(merged_sell_orders, history_data)
+    if previous is None:
+        reason = "no previous stats update recorded"
+    elif previous["watchlist"] != state["watchlist"]:
+        reason = "watchlist changed"
+    elif previous["history_window"] != state["history_window"]:
+        reason = "history window moved"
+    elif changes["replaced"]:
+        reason = "market_order was replaced"
+    elif history_changed is None:
+        reason = "history was fully refreshed"
+    else:
+        reason = None
+
+    if reason:
+        logger.info(f"full market stats recompute: {reason}")
+        return {"type_ids": None, "state": state}
+    type_ids = sorted(changes["type_ids"] | {int(type_id) for type_id in history_changed})
+    logger.info(f"market stats: {len(type_ids)} items changed since the last update")
+    return {"type_ids": type_ids, "state": state}
+
+def fill_like_saved(stats: DataFrame) -> DataFrame:
+    # Market_Stats stores NaN as 0 (update_stats), so fresh stats are filled the same way. Then a
+    # full recompute and saved rows with a few recomputed ones give the same frame
+    return stats.infer_objects().fillna(0)
+
+def update_changed_stats(merged_stats: DataFrame, type_ids: list) -> DataFrame | None:
+    # the saved Market_Stats with the rows for type_ids replaced by merged_stats. None if the
+    # columns don't line up (e.g. new stats were added), so everything has to be recomputed
+    current = read_sql_market_stats()
+    if set(current.columns) - {"timestamp"} != set(merged_stats.columns):
+        logger.info("Market_Stats columns changed, falling back to a full recompute")
+        return None
+    current = current[~current["type_id"].isin(type_ids)][list(merged_stats.columns)]
+    final_data = pd.concat([current, fill_like_saved(merged_stats)], ignore_index=True)
+    return final_data.sort_values("type_id").reset_index(drop=True)
+
+def process_orders(market_orders, stats_engine: str = "pandas",
+                   stats_update: dict | None = None) -> tuple[DataFrame, DataFrame, DataFrame | None]:
+    """Market stats and Jita prices. If stats_update (from plan_stats_update) lists type_ids only
+    those items are recomputed and the rest come from Market_Stats; an empty list means the saved
+    stats are used as they are. If that isn't possible its type_ids are set to None and
+    everything is recomputed.
+    With stats_engine="polars" the rows for items without orders come back too, for save_data."""
+    if stats_update and stats_update["type_ids"] == []:
+        # nothing on the watchlist changed, so the saved stats are still current
+        logger.info("no watchlist items changed, using the saved market stats | process_orders()")
+        final_data = read_sql_market_stats().drop(columns="timestamp", errors="ignore")
+        vale_jita = get_jita_prices(final_data)
+        return vale_jita, final_data, None
+    if stats_update and stats_update["type_ids"] is not None:
+        type_ids = stats_update["type_ids"]
+        logger.info(f"recomputing stats for {len(type_ids)} changed items | process_orders()")
+        merged_stats = merge_market_stats(aggregate_sell_orders(market_orders, type_ids))
+        final_data = update_changed_stats(merged_stats, type_ids)
+        if final_data is not None:
+            vale_jita = get_jita_prices(final_data)
+            return vale_jita, final_data, None
+        stats_update["type_ids"] = None
+
+    missing_stats = None
+    if stats_engine == "polars":
+        logger.info("aggregating sell orders and merging historical data with polars | process_orders()")
+        final_data, missing_stats = polars_market_stats(market_orders)
+    else:
+        logger.info("aggregating sell orders | process_orders()")
+        merged_sell_orders = aggregate_sell_orders(market_orders)
+
+        logger.info("merging historical data | process_orders()")
+        final_data = merge_market_stats(merged_sell_orders)
+    final_data = fill_like_saved(final_data)
 
     logger.info(type(final_data))
     logger.info("getting jita prices | process_orders()")
     vale_jita = get_jita_prices(final_data)
-    return vale_jita, final_data
+    return vale_jita, final_data, missing_stats
 
-def save_data(history: DataFrame, vale_jita: DataFrame, final_data: DataFrame, fresh_data: bool = True):
+def save_data(history: DataFrame, vale_jita: DataFrame, final_data: DataFrame, fresh_data: bool = True,
+              missing_stats: DataFrame | None = None, stats_update: dict | None = None):
     update_time = datetime.utcnow()
     if fresh_data:
         new_columns = [
@@ -439,14 +914,24 @@ def save_data(history: DataFrame, vale_jita: DataFrame, final_data: DataFrame, f
     final_data['timestamp'] = update_time
 
     logger.info(print('saving market stats to database'))
-    status = update_stats(final_data)
+    if stats_update and stats_update["type_ids"] == []:
+        status = "no watchlist items changed, Market_Stats left as it is"
+    elif stats_update and stats_update["type_ids"] is not None:
+        status = update_stats_rows(final_data, stats_update["type_ids"])
+    else:
+        status = update_stats(final_data)
+    if stats_update:
+        save_market_stats_state(stats_update["state"])
     logger.info(status)
     logger.info(
         print(
             f"saving market stats to google sheet. update time: {update_time}"
         ))
 
-    final_data = fill_missing_stats_v2(final_data, watchlist)
+    if missing_stats is None:
+        final_data = fill_missing_stats_v2(final_data, watchlist)
+    else:
+        final_data = polars_engine.fill_missing_stats(final_data, missing_stats)
     logger.info("saving market stats to csv")
     final_data.to_csv(market_stats_filename, index=False)
 
@@ -464,7 +949,7 @@ def save_data(history: DataFrame, vale_jita: DataFrame, final_data: DataFrame, f
     logger.info(status)
 
 
-def main() -> bool | None:
+def main() -> argparse.Namespace:
     # Create the parser
     parser = argparse.ArgumentParser(description="options for market ESI calls")
 
@@ -473,35 +958,79 @@ def main() -> bool | None:
                         action="store_true",
                         help="Refresh history data"
                         )
+    parser.add_argument("--workers",
+                        type=int,
+                        default=PAGE_WORKERS,
+                        help=f"Number of market order pages to fetch concurrently (default {PAGE_WORKERS}, 1 = serial)"
+                        )
+    parser.add_argument("--incremental",
+                        action="store_true",
+                        help="Fetch history only for items missing recent days, and add just the new rows"
+                        )
+    parser.add_argument("--history-budget",
+                        type=int,
+                        default=HISTORY_BUDGET,
+                        help=f"Most history requests an incremental refresh may make (default {HISTORY_BUDGET})"
+                        )
+    parser.add_argument("--history-workers",
+                        type=int,
+                        default=HISTORY_WORKERS,
+                        help=f"Number of history items to fetch concurrently (default {HISTORY_WORKERS}, 1 = serial)"
+                        )
+    parser.add_argument("--schedule",
+                        action="store_true",
+                        help="Keep running and update whenever ESI's cached orders or history expire"
+                        )
+    parser.add_argument("--force",
+                        action="store_true",
+                        help="Fetch market orders even if ESI says they haven't expired yet"
+                        )
+    parser.add_argument("--resume",
+                        action="store_true",
+                        help="Carry on from the last interrupted order or history fetch instead of starting over"
+                        )
+    parser.add_argument("--engine",
+                        choices=STATS_ENGINES,
+                        default="pandas",
+                        help="Dataframe engine for the market stats (default pandas)"
+                        )
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help="Ignore the ETag page cache and download every market order page"
+                        )
 
     args = parser.parse_args()
 
-    if args.hist:
+    if args.schedule:
+        print("Running market updates on ESI's expiry schedule.")
+    elif args.hist:
         print("Running market update with full history refresh.")
-        return True
+    elif args.incremental:
+        print("Running market update with incremental history refresh.")
     else:
         print("Running market update in quick mode, saved history data will be used.")
-        return None
-
-if __name__ == "__main__":
-
+    return args
+
+def run_market_update(fresh_data_choice: bool, workers: int = PAGE_WORKERS, use_cache: bool = True,
+                      refresh_orders: bool = True, resume: bool = False,
+                      history_workers: int = HISTORY_WORKERS, incremental: bool = False,
+                      history_budget: int | None = HISTORY_BUDGET, stats_engine: str = "pandas") -> DataFrame:
+    """Runs one full market update. With refresh_orders=False the saved market orders are
+    reused instead of fetching new ones from ESI. With incremental=True (and no full history
+    refresh) only the history items that are behind are fetched. stats_engine picks pandas or
+    polars for the market stats."""
+    global watchlist, history_filename, market_stats_filename
 
     logger.info("START OF MARKET UPDATE")
     logger.info("="*80)
 
-    # ===============================================
-    # MAIN PROGRAM
-    # -----------------------------------------------
-    # Main function where everything gets executed.
-    refresh_hist = main()
-
-    if refresh_hist:
-        fresh_data_choice = True
-    else:
-        fresh_data_choice = False
+    # new file names for every run, so scheduled runs don't overwrite each other
+    history_filename = f"output/valemarkethistory_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
+    market_stats_filename = f"output/valemarketstats_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.csv"
 
     start_time = datetime.now()
     logger.info(f"starting program: {start_time}")
+    http_client.metrics.reset()
 
     # retrieve current watchlist from database
     logger.info(f"reading watchlist from database")
@@ -512,20 +1041,38 @@ if __name__ == "__main__":
     watchlist.to_csv("output/brazil/watchlist.csv", index=False)
 
     logger.info("MARKET ORDERS")
-    logger.info("starting update...market orders")
+    structures = read_market_structures()
+    logger.info(f"{len(structures)} market structure(s) configured")
     # =========================================
-    market_orders = fetch_market_orders()
+    # all structures are fetched together. primary pages are saved to the database as they arrive
+    orders_counts = fetch_structures(structures, workers=workers, use_cache=use_cache,
+                                     refresh_primary=refresh_orders, resume=resume)
     # ==========================================
+    for sid, count in orders_counts.items():
+        logger.info(f"saved {count} market orders for structure {sid}")
 
-    logger.info("saving to database...market orders")
-    orders_status = process_esi_market_order_optimized(market_orders, False)
-    logger.info(orders_status)
+    if refresh_orders:
+        # keep a compressed copy of the book for backtesting
+        try:
+            write_snapshot(structure_id)
+        except Exception as e:
+            logger.error(f"failed to archive order book snapshot: {e}")
+    else:
+        logger.info("market orders not expired, using saved market orders")
+
+    # orders are read back from market_order when they are aggregated
+    market_orders = None
 
     # update history data
     logger.info("HISTORY CHECKS")
     logger.info("updating history data")
     # =============================================
-    historical_df, all_history = fetch_market_history(fresh_data_choice)
+    if incremental and not fresh_data_choice:
+        historical_df = update_history_incremental(resume=resume, workers=history_workers, budget=history_budget)
+        history_changed = historical_df.attrs["changed"]
+    else:
+        historical_df, all_history = fetch_market_history(fresh_data_choice, resume=resume, workers=history_workers)
+        history_changed = None if fresh_data_choice else []
     # ==============================================
 
     # #save to database
@@ -538,10 +1085,18 @@ if __name__ == "__main__":
 
     # process market orders
     logger.info("processing orders")
-    vale_jita, final_data = process_orders(market_orders, historical_df)
+    # only the items whose orders or history changed are recomputed, when that's safe
+    stats_update = plan_stats_update(history_changed)
+    vale_jita, final_data, missing_stats = process_orders(market_orders, stats_engine, stats_update)
     # check doctrine market status
 
-    save_data(historical_df, vale_jita, final_data, fresh_data_choice)
+    save_data(historical_df, vale_jita, final_data, fresh_data_choice, missing_stats, stats_update)
+
+    # stats for every configured structure. Market_Stats above stays the primary structure's
+    try:
+        logger.info(update_structure_stats(aggregate_structure_stats(structures)))
+    except Exception as e:
+        logger.error(f"failed to update per-structure stats: {e}")
 
     # '<><><><><>'
     # prepare data for our experimental Turso db
@@ -571,7 +1126,66 @@ if __name__ == "__main__":
 
     logger.info(f"Data for {len(final_data.index)} items retrieved.")
     logger.info(f"Total time: {total_time}")
+    # request counts, connections opened and handshake time per host
+    http_client.log_summary()
     logger.info("market update complete")
 
     logger.info("END OF MARKET UPDATE")
     logger.info("="*80)
+    return final_data
+
+
+def run_scheduler(args: argparse.Namespace):
+    """Runs forever, waking when ESI's cached orders or history expire.
+
+    Stages whose upstream data hasn't expired are skipped: if neither orders nor history have
+    expired nothing is fetched, written or pushed to Sheets.
+    """
+    orders_key = orders_endpoint(structure_id)
+    history_key = history_endpoint()
+
+    while True:
+        orders_due = is_expired(orders_key)
+        history_due = is_expired(history_key)
+
+        if orders_due or history_due:
+            logger.info(f"scheduler: orders expired: {orders_due}, history expired: {history_due}")
+            try:
+                run_market_update(history_due and not args.incremental, workers=args.workers,
+                                  use_cache=not args.no_cache, refresh_orders=orders_due,
+                                  history_workers=args.history_workers, incremental=history_due and args.incremental,
+                                  history_budget=args.history_budget, stats_engine=args.engine)
+            except Exception as e:
+                # keep the scheduler alive; the next wake will retry
+                logger.error(f"scheduled market update failed: {e}")
+        else:
+            logger.info("scheduler: ESI data not expired, nothing to do")
+
+        wake = next_expiry([orders_key, history_key])
+        now = datetime.now(timezone.utc)
+        delay = (wake - now).total_seconds() + SCHEDULE_MARGIN if wake else SCHEDULE_MIN_SLEEP
+        delay = max(delay, SCHEDULE_MIN_SLEEP)
+        print(f"next update at {now + timedelta(seconds=delay):%Y-%m-%d %H:%M:%S} UTC")
+        logger.info(f"scheduler sleeping {delay:.0f}s until {wake}")
+        time.sleep(delay)
+
+
+if __name__ == "__main__":
+    # ===============================================
+    # MAIN PROGRAM
+    # -----------------------------------------------
+    # Main function where everything gets executed.
+    args = main()
+
+    if args.schedule:
+        run_scheduler(args)
+    else:
+        orders_due = args.force or args.resume or is_expired(orders_endpoint(structure_id))
+        if not orders_due and not args.hist and not args.incremental:
+            print("Market orders are still cached by ESI. Nothing to update (use --force to run anyway).")
+            logger.info("market orders not expired, skipping update")
+        else:
+            run_market_update(args.hist, workers=args.workers, use_cache=not args.no_cache,
+                              refresh_orders=orders_due, resume=args.resume, history_workers=args.history_workers,
+                              incremental=args.incremental, history_budget=args.history_budget,
+                              stats_engine=args.engine)
@@ -0,0 +1,287 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+# ---------------------------------------------
+# Benchmarks
+# ---------------------------------------------
+# Offline timing runs for the market tools. Nothing here talks to Tranquility; the fetch
+# benchmarks run against the local stand-in in esi_standin.py.
+# usage: python benchmarks.py fetch --workers 8 --latency 0.2
+#        python benchmarks.py decode --orders 1000000
+#        python benchmarks.py faults --error-rate 0.05 --limit-rate 0.01
+#        python benchmarks.py history --items 500 --workers 8
+#        python benchmarks.py aggregate
+#        python benchmarks.py weighted
+# The fetch benchmarks record ESI expiries in a throwaway store, so they never move the real
+# scheduler's next fetch time.
+
+
+@contextmanager
+def scratch_expiry_store():
+    # record_expiry saves to esi_expiry.cache_sqlfile, read each time it opens the database
+    import esi_expiry
+    real_store = esi_expiry.cache_sqlfile
+    esi_expiry.cache_sqlfile = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_expiry.sqlite')}"
+    try:
+        yield
+    finally:
+        esi_expiry.cache_sqlfile = real_store
+
+
+def bench_fetch_market_orders(page_counts=(10, 50, 100), workers: int = 8, latency: float = 0.2) -> list[dict]:
+    from MarketStructures8 import fetch_market_orders
+    from esi_standin import start_standin
+
+    results = []
+    errors_file = os.path.join(tempfile.gettempdir(), "bench_errors.json")
+    token = {"access_token": "benchmark"}
+
+    for pages in page_counts:
+        server, url = start_standin(pages=pages, latency=latency, orders_ttl=0)
+        try:
+            row = {"pages": pages}
+            for label, n in (("serial", 1), (f"{workers} workers", workers)):
+                start = time.perf_counter()
+                with scratch_expiry_store():
+                    orders, _ = fetch_market_orders(workers=n, url=url, token=token, errors_file=errors_file,
+                                                    use_cache=False)
+                row[label] = time.perf_counter() - start
+                row["orders"] = len(orders)
+            results.append(row)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    print(f"\n\nfetch_market_orders against local stand-in ({latency}s latency per page)")
+    print(f"{'pages':>6} {'orders':>8} {'serial (s)':>12} {f'{workers} workers (s)':>16} {'speedup':>8}")
+    for row in results:
+        serial = row["serial"]
+        parallel = row[f"{workers} workers"]
+        print(f"{row['pages']:>6} {row['orders']:>8} {serial:>12.2f} {parallel:>16.2f} {serial / parallel:>7.1f}x")
+    return results
+
+
+def bench_decode_orders(total_orders: int = 1_000_000, orders_per_page: int = 1000) -> dict:
+    # response.json() into dicts, then a DataFrame, vs columnar decoding with esi_decode
+    import pandas as pd
+    from esi_decode import decode_orders, to_pandas, order_columns
+    from esi_standin import synthetic_orders
+
+    pages = max(1, total_orders // orders_per_page)
+    bodies = [json.dumps(synthetic_orders(page, orders_per_page)).encode() for page in range(1, pages + 1)]
+    print(f"decoding {pages} pages of {orders_per_page} orders ({sum(map(len, bodies)) / 1e6:.0f} MB of JSON)")
+
+    start = time.perf_counter()
+    all_orders = []
+    for body in bodies:
+        all_orders.extend(json.loads(body))
+    df = pd.DataFrame(all_orders, columns=order_columns)
+    df["issued"] = pd.to_datetime(df["issued"])
+    dict_time = time.perf_counter() - start
+    del all_orders, df
+
+    start = time.perf_counter()
+    df = to_pandas([decode_orders(body) for body in bodies], order_columns)
+    columnar_time = time.perf_counter() - start
+
+    print(f"\n{'path':<28} {'seconds':>8}")
+    print(f"{'response.json() + dicts':<28} {dict_time:>8.2f}")
+    print(f"{'columnar (esi_decode)':<28} {columnar_time:>8.2f}")
+    print(f"{len(df)} orders, {dict_time / columnar_time:.1f}x faster")
+    return {"orders": len(df), "dicts": dict_time, "columnar": columnar_time}
+
+
+def bench_fault_injection(pages: int = 50, workers: int = 8, latency: float = 0.1, error_rate: float = 0.05,
+                          limit_rate: float = 0.0, timeout_rate: float = 0.0, timeout_delay: float = 11.0) -> dict:
+    # order fetch throughput and retry behaviour while the stand-in returns errors
+    from MarketStructures8 import fetch_market_orders
+    from esi_standin import start_standin
+
+    errors_file = os.path.join(tempfile.gettempdir(), "bench_errors.json")
+    server, url = start_standin(pages=pages, latency=latency, orders_ttl=0, error_rate=error_rate,
+                                limit_rate=limit_rate, timeout_rate=timeout_rate, timeout_delay=timeout_delay)
+    try:
+        start = time.perf_counter()
+        with scratch_expiry_store():
+            orders, report = fetch_market_orders(workers=workers, url=url, token={"access_token": "benchmark"},
+                                                 errors_file=errors_file, use_cache=False)
+        elapsed = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    print(f"\n\nfetch_market_orders, {pages} pages, {workers} workers, {latency}s latency")
+    print(f"injected: {error_rate:.0%} 5xx, {limit_rate:.0%} 420, {timeout_rate:.0%} timeouts")
+    print(f"{elapsed:.2f}s, {pages / elapsed:.1f} pages/s, {len(orders)} orders")
+    print(f"served {server.counts['requests']} requests, {server.counts['errors']} errors, "
+          f"{server.counts['timeouts']} hung")
+    print(f"pages fetched: {report['total_pages']} of {report['max_pages']}, failed: {report['failed_pages_count']}, "
+          f"errors seen by the fetcher: {report['errors_detected']}")
+    return {"seconds": elapsed, **server.counts, **report}
+
+
+def bench_fetch_market_history(items: int = 500, workers: int = 8, latency: float = 0.2) -> list[dict]:
+    # serial vs parallel history fetch. The runs are journaled in a throwaway database, so an
+    # unfinished real history run in market_orders.sqlite is left for --resume to pick up, and the
+    # history expiry goes to a throwaway store too
+    import fetch_journal
+    import MarketStructures8
+    from esi_standin import start_standin
+
+    server, _ = start_standin(latency=latency, history_ttl=0)
+    type_ids = list(range(1, items + 1))
+    results = []
+    real_journal = fetch_journal.journal_sqlfile
+    fetch_journal.journal_sqlfile = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench_journal.sqlite')}"
+    try:
+        for n in (1, workers):
+            start = time.perf_counter()
+            with scratch_expiry_store():
+                history, _ = MarketStructures8.fetch_market_history(True, id_list=type_ids, url=server.base_url +
+                                                                    "/markets/10000003/history/?type_id=",
+                                                                    workers=n)
+            results.append({"workers": n, "seconds": time.perf_counter() - start, "rows": len(history)})
+    finally:
+        fetch_journal.journal_sqlfile = real_journal
+        server.shutdown()
+        server.server_close()
+
+    print(f"\n\nfetch_market_history against local stand-in, {items} items ({latency}s latency per item)")
+    print(f"{'workers':>8} {'rows':>9} {'seconds':>9} {'items/s':>8}")
+    for row in results:
+        print(f"{row['workers']:>8} {row['rows']:>9} {row['seconds']:>9.2f} {items / row['seconds']:>8.1f}")
+    print(f"speedup: {results[0]['seconds'] / results[-1]['seconds']:.1f}x")
+    return results
+
+
+def synthetic_sell_book(n: int, types: int = 5000, seed: int = 0):
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "type_id": rng.integers(1, types + 1, n),
+        "volume_remain": rng.integers(1, 1000, n),
+        "price": np.round(rng.uniform(1, 1_000_000, n), 2),
+        "is_buy_order": np.zeros(n, dtype=bool),
+    })
+
+
+def groupby_sell_stats(sell_orders):
+    # the aggregation aggregate_sell_orders did before order_stats: three groupbys and two merges
+    import pandas as pd
+
+    grouped_df = sell_orders.groupby("type_id")["volume_remain"].sum().reset_index()
+    grouped_df.columns = ["type_id", "total_volume_remain"]
+    min_price_df = sell_orders.groupby("type_id")["price"].min().reset_index()
+    min_price_df.columns = ["type_id", "min_price"]
+    percentile_5th_df = sell_orders.groupby("type_id")["price"].quantile(0.05).reset_index()
+    percentile_5th_df.columns = ["type_id", "price_5th_percentile"]
+    merged_df = pd.merge(grouped_df, min_price_df, on="type_id")
+    return pd.merge(merged_df, percentile_5th_df, on="type_id")
+
+
+def bench_aggregate(sizes=(100_000, 1_000_000, 5_000_000), repeats: int = 3) -> list[dict]:
+    import pandas as pd
+    from order_stats import sell_order_stats
+
+    results = []
+    for n in sizes:
+        book = synthetic_sell_book(n)
+        row = {"orders": n}
+        for label, fn in (("groupby", groupby_sell_stats), ("order_stats", sell_order_stats)):
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                out = fn(book)
+                times.append(time.perf_counter() - start)
+            row[label] = min(times)
+            row[f"{label}_out"] = out
+        pd.testing.assert_frame_equal(row.pop("groupby_out"), row.pop("order_stats_out"))
+        results.append(row)
+
+    print(f"\n\nsell order aggregation, best of {repeats} (outputs checked equal)")
+    print(f"{'orders':>10} {'groupby (s)':>12} {'order_stats (s)':>16} {'speedup':>8}")
+    for row in results:
+        print(f"{row['orders']:>10} {row['groupby']:>12.3f} {row['order_stats']:>16.3f} "
+              f"{row['groupby'] / row['order_stats']:>7.1f}x")
+    return results
+
+
+def groupby_weighted_quantiles(sell_orders, quantiles):
+    # volume-weighted percentiles the plain pandas way: sort, cumsum per type, then the first
+    # row per type whose running volume reaches each quantile's unit
+    import numpy as np
+    import pandas as pd
+    from order_stats import weighted_quantile_column
+
+    book = sell_orders.sort_values(["type_id", "price"], kind="stable")
+    grouped = book.groupby("type_id")["volume_remain"]
+    running = grouped.cumsum()
+    total = grouped.transform("sum")
+    stats = pd.DataFrame({"type_id": book["type_id"].unique()})
+    for quantile in quantiles:
+        rank = np.clip(np.ceil(np.round(quantile * total, 9)), 1, None)
+        reached = book[running >= rank].groupby("type_id")["price"].first()
+        stats[weighted_quantile_column(quantile)] = stats["type_id"].map(reached).to_numpy()
+    return stats
+
+
+def bench_weighted_quantiles(sizes=(1_000_000, 5_000_000), quantiles=(0.05, 0.25, 0.5, 0.75, 0.95),
+                             repeats: int = 3) -> list[dict]:
+    import pandas as pd
+    from order_stats import weighted_quantiles
+
+    results = []
+    for n in sizes:
+        book = synthetic_sell_book(n)
+        row = {"orders": n}
+        for label, fn in (("groupby", groupby_weighted_quantiles), ("order_stats", weighted_quantiles)):
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                out = fn(book, list(quantiles))
+                times.append(time.perf_counter() - start)
+            row[label] = min(times)
+            row[f"{label}_out"] = out
+        pd.testing.assert_frame_equal(row.pop("groupby_out"), row.pop("order_stats_out"))
+        results.append(row)
+
+    print(f"\n\nvolume-weighted percentiles {list(quantiles)}, best of {repeats} (outputs checked equal)")
+    print(f"{'orders':>10} {'groupby (s)':>12} {'order_stats (s)':>16} {'speedup':>8}")
+    for row in results:
+        print(f"{row['orders']:>10} {row['groupby']:>12.3f} {row['order_stats']:>16.3f} "
+              f"{row['groupby'] / row['order_stats']:>7.1f}x")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="offline benchmarks for the market tools")
+    parser.add_argument("benchmark", choices=["fetch", "decode", "faults", "history", "aggregate", "weighted"])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--items", type=int, default=500)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--limit-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    if args.benchmark == "fetch":
+        bench_fetch_market_orders(workers=args.workers, latency=args.latency)
+    elif args.benchmark == "decode":
+        bench_decode_orders(total_orders=args.orders)
+    elif args.benchmark == "faults":
+        bench_fault_injection(pages=args.pages, workers=args.workers, latency=args.latency,
+                              error_rate=args.error_rate, limit_rate=args.limit_rate, timeout_rate=args.timeout_rate)
+    elif args.benchmark == "history":
+        bench_fetch_market_history(items=args.items, workers=args.workers, latency=args.latency)
+    elif args.benchmark == "aggregate":
+        bench_aggregate()
+    elif args.benchmark == "weighted":
+        bench_weighted_quantiles()
@@ -0,0 +1,90 @@
+from io import BytesIO
+
+import pandas as pd
+import polars as pl
+
+import logging_tool
+
+logger = logging_tool.configure_logging(log_name=__name__)
+
+# ---------------------------------------------
+# Columnar ESI decoding
+# ---------------------------------------------
+# Turns ESI response bodies straight into typed columns with polars' JSON reader, instead of
+# building a Python dict per order with response.json(). Only the columns we keep are decoded:
+# int64 ids and volumes, float64 prices, bool flags and datetime timestamps. Pages are
+# concatenated as columns and handed to pandas in one go.
+
+order_schema = {
+    "duration": pl.Int64,
+    "is_buy_order": pl.Boolean,
+    "issued": pl.String,
+    "order_id": pl.Int64,
+    "price": pl.Float64,
+    "type_id": pl.Int64,
+    "volume_remain": pl.Int64,
+}
+order_columns = ["type_id", "volume_remain", "price", "issued", "duration", "order_id", "is_buy_order"]
+
+history_schema = {
+    "average": pl.Float64,
+    "date": pl.String,
+    "highest": pl.Float64,
+    "lowest": pl.Float64,
+    "order_count": pl.Int64,
+    "volume": pl.Int64,
+}
+
+
+def _read(content: bytes | str, schema: dict) -> pl.DataFrame:
+    if isinstance(content, str):
+        content = content.encode()
+    if not content.strip() or content.strip() == b"[]":
+        return pl.DataFrame(schema=schema)
+    return pl.read_json(BytesIO(content), schema=schema)
+
+
+def decode_orders(content: bytes | str) -> pl.DataFrame:
+    """Decodes one page of structure orders into a typed frame in market_order column order.
+
+    Raises ValueError if the body isn't a JSON list of orders.
+    """
+    try:
+        frame = _read(content, order_schema)
+    except pl.exceptions.PolarsError as e:
+        raise ValueError(f"could not decode orders: {e}") from e
+    return frame.with_columns(
+        pl.col("issued").str.to_datetime(strict=False, time_unit="us", time_zone="UTC"),
+    ).select(order_columns)
+
+
+def decode_history(content: bytes | str, type_id: int) -> pl.DataFrame:
+    # one type's daily history, with the type_id added as a column
+    try:
+        frame = _read(content, history_schema)
+    except pl.exceptions.PolarsError as e:
+        raise ValueError(f"could not decode history for {type_id}: {e}") from e
+    return frame.with_columns(
+        pl.col("date").str.to_date(strict=False),
+        pl.lit(int(type_id), dtype=pl.Int64).alias("type_id"),
+    )
+
+
+def frame_to_pandas(frame: pl.DataFrame) -> pd.DataFrame:
+    # column by column through numpy, so pyarrow isn't needed. numeric columns aren't copied
+    columns = {}
+    for name, series in zip(frame.columns, frame.get_columns()):
+        if isinstance(series.dtype, pl.Datetime) and series.dtype.time_zone:
+            values = series.dt.replace_time_zone(None).to_numpy()
+            columns[name] = pd.DatetimeIndex(values).tz_localize(series.dtype.time_zone)
+        else:
+            columns[name] = series.to_numpy()
+    return pd.DataFrame(columns, columns=frame.columns)
+
+
+def to_pandas(frames: list[pl.DataFrame], columns: list | None = None) -> pd.DataFrame:
+    # concatenates decoded pages column-wise and converts once
+    frames = [f for f in frames if f.height]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return frame_to_pandas(pl.concat(frames, how="vertical"))
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from sqlalchemy import create_engine, text
+
+import logging_tool
+from etag_cache import cache_sqlfile
+
+logger = logging_tool.configure_logging(log_name=__name__)
+
+# ---------------------------------------------
+# ESI expiry tracking
+# ---------------------------------------------
+# ESI tells us how long its cached data is good for with the Expires header: about 5 minutes for
+# structure orders, and until the daily downtime for regional history. We save the expiry per
+# endpoint so the scheduler only fetches when ESI actually has something new.
+
+
+def orders_endpoint(structure_id: int) -> str:
+    return f"orders:{structure_id}"
+
+
+def history_endpoint(region_id: int = 10000003) -> str:
+    return f"history:{region_id}"
+
+
+def _engine():
+    engine = create_engine(cache_sqlfile, echo=False)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS esi_expiry (
+                endpoint TEXT PRIMARY KEY,
+                expires  TEXT,
+                updated  TEXT
+            )
+        """))
+    return engine
+
+
+def parse_expires(header: str | None) -> datetime | None:
+    # Expires is an HTTP date, e.g. 'Sat, 18 Oct 2025 11:05:00 GMT'
+    if not header:
+        return None
+    try:
+        return parsedate_to_datetime(header).astimezone(timezone.utc)
+    except (TypeError, ValueError):
+        logger.warning(f"could not parse Expires header: {header}")
+        return None
+
+
+def record_expiry(endpoint: str, expires: datetime | str | None):
+    if isinstance(expires, str):
+        expires = parse_expires(expires)
+    if expires is None:
+        return
+    with _engine().begin() as conn:
+        conn.execute(
+            text("INSERT OR REPLACE INTO esi_expiry (endpoint, expires, updated) VALUES (:endpoint, :expires, :updated)"),
+            {"endpoint": endpoint, "expires": expires.isoformat(),
+             "updated": datetime.now(timezone.utc).isoformat()},
+        )
+    logger.info(f"{endpoint} cached by ESI until {expires}")
+
+
+def get_expiry(endpoint: str) -> datetime | None:
+    with _engine().connect() as conn:
+        row = conn.execute(
+            text("SELECT expires FROM esi_expiry WHERE endpoint = :endpoint"), {"endpoint": endpoint}
+        ).fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+
+def is_expired(endpoint: str, now: datetime | None = None) -> bool:
+    # True if ESI should have new data, or if we have never seen this endpoint
+    expires = get_expiry(endpoint)
+    now = now or datetime.now(timezone.utc)
+    return expires is None or now >= expires
+
+
+def next_expiry(endpoints: list[str]) -> datetime | None:
+    # the earliest time any of the endpoints will have fresh data
+    expiries = [e for e in (get_expiry(endpoint) for endpoint in endpoints) if e is not None]
+    return min(expiries) if expiries else None
@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+
+import requests
+
+import http_client
+import logging_tool
+
+logger = logging_tool.configure_logging(log_name=__name__)
+
+# ---------------------------------------------
+# ESI error-limit governor
+# ---------------------------------------------
+# ESI allows 100 errors per rolling window and bans the IP if we keep going after that. Every
+# outbound call goes through the one governor below so the fetchers share a single error budget,
+# however many threads are running.
+
+RETRY_STATUSES = {420, 429, 500, 502, 503, 504}
+
+
+class ErrorLimitGovernor:
+    """Process-wide token bucket for outbound requests.
+
+    Two buckets are kept. The error bucket holds the error budget reported by the
+    X-ESI-Error-Limit-Remain header and refills when X-ESI-Error-Limit-Reset runs out. Each request
+    in flight reserves a token from it, so a burst of parallel requests can't spend the budget
+    before the headers come back. The rate bucket paces requests to `rate` per second.
+    Failed requests are retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, rate: float = 50.0, burst: int = 50, error_limit: int = 100, error_floor: int = 10,
+                 max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.rate = rate
+        self.burst = burst
+        self.error_limit = error_limit
+        self.error_floor = error_floor
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Condition()
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+        self._errors_remain = error_limit
+        self._reset_at = 0.0
+        self._in_flight = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+        if self._reset_at and now >= self._reset_at:
+            self._errors_remain = self.error_limit
+            self._reset_at = 0.0
+
+    def acquire(self):
+        # blocks until a request may be sent without risking the error limit
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self._errors_remain - self._in_flight <= self.error_floor:
+                    if not self._reset_at:
+                        self._reset_at = now + 60
+                    wait = max(self._reset_at - now, 0.1)
+                    logger.warning(f"error budget low ({self._errors_remain} left), waiting {wait:.1f}s for reset")
+                elif self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return
+                self._lock.wait(wait)
+
+    def release(self, response: requests.Response | None):
+        # returns the reserved token and updates the budget from the response headers
+        with self._lock:
+            self._in_flight -= 1
+            if response is not None:
+                self.update(response)
+            self._lock.notify_all()
+
+    def update(self, response: requests.Response):
+        remain = response.headers.get("X-ESI-Error-Limit-Remain")
+        reset = response.headers.get("X-ESI-Error-Limit-Reset")
+        if remain is not None:
+            self._errors_remain = int(remain)
+        if reset is not None:
+            self._reset_at = time.monotonic() + int(reset)
+        if response.status_code == 420:
+            # error limited. nothing more goes out until the window resets
+            self._errors_remain = 0
+            if not self._reset_at:
+                self._reset_at = time.monotonic() + 60
+        if self._errors_remain < self.error_floor:
+            logger.error(f"Errors remaining: {self._errors_remain}. Error limit reset: {reset}")
+
+    def backoff(self, attempt: int) -> float:
+        # exponential backoff with jitter: half the delay is fixed, half is random
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def request(self, method: str, url: str, max_retries: int | None = None, **kwargs) -> requests.Response:
+        """Sends a request through the governor, retrying timeouts and retryable status codes.
+
+        The last response is returned even if it is still an error, so callers keep their own
+        failure accounting. response.attempts holds the number of tries it took. A timeout or
+        connection error on the final try is raised.
+        """
+        retries = self.max_retries if max_retries is None else max_retries
+
+        for attempt in range(retries + 1):
+            self.acquire()
+            try:
+                response = http_client.request(method, url, **kwargs)
+            except (requests.Timeout, requests.ConnectionError) as e:
+                self.release(None)
+                if attempt >= retries:
+                    raise
+                delay = self.backoff(attempt)
+                logger.warning(f"{method} {url} failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self.release(response)
+            response.attempts = attempt + 1
+            if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                return response
+
+            delay = self.backoff(attempt)
+            logger.warning(f"{method} {url} returned {response.status_code}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+
+# the process-wide governor. import this rather than creating another one.
+governor = ErrorLimitGovernor()
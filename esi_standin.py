@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# ---------------------------------------------
+# Local ESI stand-in
+# ---------------------------------------------
+# A small local HTTP server that answers like the ESI structure market and regional history
+# endpoints, so the fetchers can be load tested without touching Tranquility. Point the tool at it
+# with ESI_BASE_URL=http://127.0.0.1:8089/latest, or start it in a background thread with
+# start_standin().
+#
+# Responses are synthetic unless a fixture directory is given, in which case recorded bodies are
+# replayed from it:
+#   orders_<page>.json      one structure market page
+#   history_<type_id>.json  regional history for one type
+# Faults can be injected: a share of requests can return 5xx or 420, or hang past the client
+# timeout. Errors count against an ESI-style error budget, reported in the error-limit headers.
+
+ORDERS_PER_PAGE = 1000
+ORDERS_TTL = 300
+HISTORY_DAYS = 400
+ERROR_LIMIT = 100
+ERROR_WINDOW = 60
+
+
+def synthetic_orders(page: int, count: int = ORDERS_PER_PAGE, seed: int = 0) -> list[dict]:
+    # builds a page of orders shaped like the ESI structure market response
+    rng = random.Random(seed * 100003 + page)
+    issued = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    orders = []
+    for i in range(count):
+        orders.append({
+            "duration": rng.choice([30, 90]),
+            "is_buy_order": rng.random() < 0.3,
+            "issued": (issued + timedelta(minutes=rng.randint(0, 100000))).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "location_id": 1035466617946,
+            "min_volume": 1,
+            "order_id": page * 1_000_000 + i,
+            "price": round(rng.uniform(1, 1_000_000), 2),
+            "range": "region",
+            "type_id": rng.randint(1, 5000),
+            "volume_remain": rng.randint(1, 1000),
+            "volume_total": 1000,
+        })
+    return orders
+
+
+def synthetic_history(type_id: int, days: int = HISTORY_DAYS, seed: int = 0) -> list[dict]:
+    # daily history for one type, ending yesterday, shaped like the ESI regional history response
+    rng = random.Random(seed * 100003 + type_id)
+    today = datetime.now(timezone.utc).date()
+    base = rng.uniform(10, 100_000)
+    history = []
+    for n in range(days, 0, -1):
+        average = round(base * rng.uniform(0.9, 1.1), 2)
+        history.append({
+            "average": average,
+            "date": (today - timedelta(days=n)).isoformat(),
+            "highest": round(average * rng.uniform(1.0, 1.2), 2),
+            "lowest": round(average * rng.uniform(0.8, 1.0), 2),
+            "order_count": rng.randint(1, 200),
+            "volume": rng.randint(1, 50_000),
+        })
+    return history
+
+
+def next_downtime(now: datetime) -> datetime:
+    # regional history is cached until just after the daily 11:00 UTC downtime
+    downtime = now.replace(hour=11, minute=5, second=0, microsecond=0)
+    return downtime if downtime > now else downtime + timedelta(days=1)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    # settings are attached to the server instance by start_standin()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # keep benchmark output clean
+        pass
+
+    def send_json(self, status: int, body: bytes, headers: dict | None = None):
+        remain, reset = self.server.error_limit(status)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-ESI-Error-Limit-Remain", str(remain))
+        self.send_header("X-ESI-Error-Limit-Reset", str(reset))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status: int, message: str):
+        self.send_json(status, json.dumps({"error": message}).encode())
+
+    def send_cached(self, body: bytes, headers: dict):
+        # 200, or 304 if the client already has this body
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        headers = {**headers, "ETag": etag}
+        if self.headers.get("If-None-Match") == etag:
+            self.send_json(304, b"", headers)
+        else:
+            self.send_json(200, body, headers)
+
+    def do_GET(self):
+        server = self.server
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        fault = server.pick_fault()
+        if fault == "timeout":
+            # hang past the client timeout, then answer anyway
+            time.sleep(server.timeout_delay)
+        elif fault == 420 or server.error_limited():
+            self.send_error_json(420, "Error limited")
+            return
+        elif fault is not None:
+            self.send_error_json(fault, "Internal server error (injected)")
+            return
+
+        now = datetime.now(timezone.utc)
+        if "/markets/structures/" in parsed.path:
+            page = int(query.get("page", ["1"])[0])
+            if page < 1 or page > server.pages:
+                self.send_error_json(404, "Requested page does not exist!")
+                return
+            expires = format_datetime(now + timedelta(seconds=server.orders_ttl), usegmt=True)
+            self.send_cached(server.page_body(page), {"X-Pages": str(server.pages), "Expires": expires})
+            return
+
+        if re.search(r"/markets/\d+/history/", parsed.path):
+            try:
+                type_id = int(query["type_id"][0])
+            except (KeyError, ValueError):
+                self.send_error_json(400, "Missing or invalid type_id")
+                return
+            if server.history_ttl is None:
+                expires = next_downtime(now)
+            else:
+                expires = now + timedelta(seconds=server.history_ttl)
+            self.send_cached(server.history_body(type_id), {"Expires": format_datetime(expires, usegmt=True)})
+            return
+
+        self.send_error_json(404, "Not found")
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pages: int = 10, latency: float = 0.0, orders_per_page: int = ORDERS_PER_PAGE,
+                 fixtures: str | None = None, error_rate: float = 0.0, limit_rate: float = 0.0,
+                 timeout_rate: float = 0.0, timeout_delay: float = 11.0, orders_ttl: int = ORDERS_TTL,
+                 history_ttl: int | None = None, seed: int = 0):
+        super().__init__(address, StandinHandler)
+        self.latency = latency
+        self.orders_per_page = orders_per_page
+        self.fixtures = fixtures
+        self.error_rate = error_rate
+        self.limit_rate = limit_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_delay = timeout_delay
+        self.orders_ttl = orders_ttl
+        # None caches history until the next downtime, like ESI
+        self.history_ttl = history_ttl
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
+        self._errors_remain = ERROR_LIMIT
+        self._window_end = time.monotonic() + ERROR_WINDOW
+        # what was served, for benchmark reports
+        self.counts = {"requests": 0, "errors": 0, "timeouts": 0}
+
+        recorded = self.fixture_pages()
+        self.pages = recorded or pages
+
+    def fixture_pages(self) -> int:
+        if not self.fixtures or not os.path.isdir(self.fixtures):
+            return 0
+        pages = 0
+        while os.path.exists(os.path.join(self.fixtures, f"orders_{pages + 1}.json")):
+            pages += 1
+        return pages
+
+    def _body(self, key: str, build) -> bytes:
+        # bodies are built (or read from the fixtures) once and reused so the server is not the bottleneck
+        with self._lock:
+            if key not in self._bodies:
+                path = os.path.join(self.fixtures, f"{key}.json") if self.fixtures else None
+                if path and os.path.exists(path):
+                    with open(path, "rb") as f:
+                        self._bodies[key] = f.read()
+                else:
+                    self._bodies[key] = json.dumps(build()).encode()
+            return self._bodies[key]
+
+    def page_body(self, page: int) -> bytes:
+        return self._body(f"orders_{page}", lambda: synthetic_orders(page, self.orders_per_page))
+
+    def history_body(self, type_id: int) -> bytes:
+        return self._body(f"history_{type_id}", lambda: synthetic_history(type_id))
+
+    def pick_fault(self):
+        # None for a normal response, otherwise "timeout", 420 or a 5xx status
+        with self._lock:
+            self.counts["requests"] += 1
+            roll = self._rng.random()
+            if roll < self.timeout_rate:
+                self.counts["timeouts"] += 1
+                return "timeout"
+            roll -= self.timeout_rate
+            if roll < self.limit_rate:
+                return 420
+            roll -= self.limit_rate
+            if roll < self.error_rate:
+                return self._rng.choice([500, 502, 503, 504])
+        return None
+
+    def _roll_window(self, now: float):
+        if now >= self._window_end:
+            self._errors_remain = ERROR_LIMIT
+            self._window_end = now + ERROR_WINDOW
+
+    def error_limited(self) -> bool:
+        with self._lock:
+            self._roll_window(time.monotonic())
+            return self._errors_remain <= 0
+
+    def error_limit(self, status: int) -> tuple[int, int]:
+        # counts an error response against the budget; returns the remain/reset header values
+        with self._lock:
+            now = time.monotonic()
+            self._roll_window(now)
+            if status >= 400:
+                self.counts["errors"] += 1
+                self._errors_remain = max(self._errors_remain - 1, 0)
+            return self._errors_remain, max(int(self._window_end - now), 1)
+
+    @property
+    def base_url(self) -> str:
+        # use as ESI_BASE_URL
+        host, port = self.server_address
+        return f"http://{host}:{port}/latest"
+
+
+def start_standin(pages: int = 10, latency: float = 0.0, port: int = 0,
+                  orders_per_page: int = ORDERS_PER_PAGE, **faults) -> tuple[StandinServer, str]:
+    """Starts the stand-in in a background thread.
+
+    Extra keyword arguments (fixtures, error_rate, limit_rate, timeout_rate, timeout_delay,
+    orders_ttl, history_ttl, seed) are passed to StandinServer. Returns the server (call shutdown() when done)
+    and a base url in the same form as MARKET_STRUCTURE_URL, ready to have a page number
+    appended. server.base_url is the ESI_BASE_URL form.
+    """
+    server = StandinServer(("127.0.0.1", port), pages=pages, latency=latency, orders_per_page=orders_per_page,
+                           **faults)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"{server.base_url}/markets/structures/1035466617946/?page="
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="local ESI stand-in server")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds of latency added to each response")
+    parser.add_argument("--fixtures", help="directory of recorded orders_<page>.json / history_<type_id>.json bodies")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with a 5xx")
+    parser.add_argument("--limit-rate", type=float, default=0.0, help="share of requests answered with a 420")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="share of requests that hang past the client timeout")
+    parser.add_argument("--timeout-delay", type=float, default=11.0, help="seconds a hung request waits before answering")
+    args = parser.parse_args()
+
+    standin = StandinServer(("127.0.0.1", args.port), pages=args.pages, latency=args.latency, fixtures=args.fixtures,
+                            error_rate=args.error_rate, limit_rate=args.limit_rate,
+                            timeout_rate=args.timeout_rate, timeout_delay=args.timeout_delay)
+    print(f"ESI stand-in listening on {standin.base_url} ({standin.pages} pages)")
+    print(f"run the tool against it with ESI_BASE_URL={standin.base_url}")
+    standin.serve_forever()
@@ -0,0 +1,81 @@
+import pickle
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, text
+
+import logging_tool
+
+logger = logging_tool.configure_logging(log_name=__name__)
+
+# ---------------------------------------------
+# ETag cache for structure market pages
+# ---------------------------------------------
+# ESI sends an ETag with every market page. We keep the ETag and the parsed page for each
+# (structure_id, page) so the next run can ask with If-None-Match and reuse the page on a 304,
+# skipping both the download and the JSON parsing. The cache lives in its own sqlite file so it
+# doesn't bloat market_orders.sqlite.
+
+cache_sqlfile = "sqlite:///esi_cache.sqlite"
+
+
+class PageCache:
+    def __init__(self, database: str = cache_sqlfile):
+        self.engine = create_engine(database, echo=False)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS esi_page_cache (
+                    structure_id INTEGER,
+                    page         INTEGER,
+                    etag         TEXT,
+                    pages        INTEGER,
+                    body         BLOB,
+                    updated      TEXT,
+                    PRIMARY KEY (structure_id, page)
+                )
+            """))
+
+    def etags(self, structure_id: int) -> dict[int, str]:
+        # all cached ETags for a structure, keyed by page
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                text("SELECT page, etag FROM esi_page_cache WHERE structure_id = :sid"),
+                {"sid": structure_id},
+            ).fetchall()
+        return {page: etag for page, etag in rows}
+
+    def load(self, structure_id: int, page: int) -> tuple[list, int] | None:
+        # returns the cached orders and X-Pages value for a page, or None if it isn't cached
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                text("SELECT body, pages FROM esi_page_cache WHERE structure_id = :sid AND page = :page"),
+                {"sid": structure_id, "page": page},
+            ).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(row[0]), row[1]
+
+    def store(self, structure_id: int, page: int, etag: str, pages: int, orders: list):
+        with self.engine.begin() as conn:
+            conn.execute(
+                text("""
+                    INSERT OR REPLACE INTO esi_page_cache (structure_id, page, etag, pages, body, updated)
+                    VALUES (:sid, :page, :etag, :pages, :body, :updated)
+                """),
+                {"sid": structure_id, "page": page, "etag": etag, "pages": pages,
+                 "body": pickle.dumps(orders, protocol=pickle.HIGHEST_PROTOCOL),
+                 "updated": datetime.now(timezone.utc).isoformat()},
+            )
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        return {"cache_hits": self.hits, "cache_misses": self.misses}
@@ -0,0 +1,128 @@
+import json
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine, text
+
+import logging_tool
+
+logger = logging_tool.configure_logging(log_name=__name__)
+
+# ---------------------------------------------
+# Fetch journal
+# ---------------------------------------------
+# Checkpoints for long fetches, so a run that dies halfway can be picked up with --resume.
+# Each completed unit (an order page or a history type_id) is written to fetch_journal under the
+# run id. Order pages are already saved in the staging table, so their payload is just the order
+# count. History rows are kept in the payload until the run finishes.
+# The journal lives in market_orders.sqlite next to the staging tables it describes.
+
+journal_sqlfile = "sqlite:///market_orders.sqlite"
+
+
+def _engine():
+    engine = create_engine(journal_sqlfile, echo=False)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS fetch_runs (
+                run_id   TEXT PRIMARY KEY,
+                kind     TEXT,
+                started  TEXT,
+                finished TEXT
+            )
+        """))
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS fetch_journal (
+                run_id  TEXT,
+                unit    INTEGER,
+                payload TEXT,
+                updated TEXT,
+                PRIMARY KEY (run_id, unit)
+            )
+        """))
+    return engine
+
+
+def start_run(kind: str) -> str:
+    now = datetime.now(timezone.utc)
+    run_id = f"{kind}-{now.strftime('%Y%m%d%H%M%S%f')}"
+    with _engine().begin() as conn:
+        # a new run replaces any unfinished one, whose staged data is about to be thrown away
+        conn.execute(
+            text("""
+                DELETE FROM fetch_journal WHERE run_id IN
+                (SELECT run_id FROM fetch_runs WHERE kind = :kind AND finished IS NULL)
+            """),
+            {"kind": kind},
+        )
+        conn.execute(
+            text("UPDATE fetch_runs SET finished = 'abandoned' WHERE kind = :kind AND finished IS NULL"),
+            {"kind": kind},
+        )
+        conn.execute(
+            text("INSERT INTO fetch_runs (run_id, kind, started) VALUES (:run_id, :kind, :started)"),
+            {"run_id": run_id, "kind": kind, "started": now.isoformat()},
+        )
+    logger.info(f"started {kind} run {run_id}")
+    return run_id
+
+
+def latest_unfinished_run(kind: str) -> str | None:
+    with _engine().connect() as conn:
+        row = conn.execute(
+            text("""
+                SELECT run_id FROM fetch_runs
+                WHERE kind = :kind AND finished IS NULL
+                ORDER BY started DESC LIMIT 1
+            """),
+            {"kind": kind},
+        ).fetchone()
+    return row[0] if row else None
+
+
+def resume_or_start(kind: str, resume: bool) -> tuple[str, dict]:
+    """Returns the run id to use and the units it has already completed.
+
+    With resume=False, or if there is nothing to resume, a new run is started.
+    """
+    run_id = latest_unfinished_run(kind) if resume else None
+    if run_id is None:
+        if resume:
+            logger.info(f"no unfinished {kind} run to resume, starting a new one")
+        return start_run(kind), {}
+    done = completed_units(run_id)
+    print(f"resuming {kind} run {run_id}: {len(done)} units already done")
+    logger.info(f"resuming {kind} run {run_id} with {len(done)} completed units")
+    return run_id, done
+
+
+def mark_done(run_id: str, unit: int, payload=None):
+    with _engine().begin() as conn:
+        conn.execute(
+            text("""
+                INSERT OR REPLACE INTO fetch_journal (run_id, unit, payload, updated)
+                VALUES (:run_id, :unit, :payload, :updated)
+            """),
+            {"run_id": run_id, "unit": int(unit),
+             "payload": json.dumps(payload) if payload is not None else None,
+             "updated": datetime.now(timezone.utc).isoformat()},
+        )
+
+
+def completed_units(run_id: str) -> dict:
+    # unit -> payload (None for units journaled without one)
+    with _engine().connect() as conn:
+        rows = conn.execute(
+            text("SELECT unit, payload FROM fetch_journal WHERE run_id = :run_id"), {"run_id": run_id}
+        ).fetchall()
+    return {unit: json.loads(payload) if payload is not None else None for unit, payload in rows}
+
+
+def finish_run(run_id: str):
+    # the checkpoints aren't needed once a run completes
+    with _engine().begin() as conn:
+        conn.execute(
+            text("UPDATE fetch_runs SET finished = :finished WHERE run_id = :run_id"),
+            {"run_id": run_id, "finished": datetime.now(timezone.utc).isoformat()},
+        )
+        conn.execute(text("DELETE FROM fetch_journal WHERE run_id = :run_id"), {"run_id": run_id})
+    logger.info(f"finished run {run_id}")
@@ -2,9 +2,8 @@ import json
 from datetime import datetime, timedelta
 
 import pandas as pd
-import requests
-
 import logging_tool
+from esi_governor import governor
 
 sde_db = r"sqlite:///C:/Users/User/PycharmProjects/ESI_Utilities/SDE/SDE sqlite-latest.sqlite"
 
@@ -25,7 +24,7 @@ def get_jita_price_data(type_ids: list) -> pd.DataFrame:
     ids = type_ids
     ids_str = ','.join(map(str, ids))
     url = f'{base_url}{regionid}&types={ids_str}'
-    response = requests.get(url)
+    response = governor.get(url, timeout=30)
     data = response.json()
     jita_prices = parse_json(data)
     return jita_prices
@@ -37,7 +36,7 @@ def get_jita_prices(vale_data: pd.DataFrame) -> pd.DataFrame:
     ids = vale_data['type_id'].to_list()
     ids_str = ','.join(map(str, ids))
     url = f'{base_url}{regionid}&types={ids_str}'
-    response = requests.get(url)
+    response = governor.get(url, timeout=30)
     data = response.json()
     logger.info('got jita prices. parsing json')
     jita_data = parse_json(data)
@@ -94,7 +93,7 @@ def get_jita_history(type_ids: list):
     types_url = base_url + ','.join(map(str, type_ids))
     url = types_url + start + end
 
-    response = requests.get(url)
+    response = governor.get(url, timeout=30)
     data = response.json()
 
     with open('data/market_basket.json', 'w') as f:
@@ -134,7 +133,7 @@ def process_market_basket():
     df3['price_date'] = pd.to_datetime(df3['price_date'])
     df3['ore'] = df3['ore'].str.lower()
 
-    df3['mined_value'] = df3.apply(lambda row: row['sell_price_avg'] * row['qty'], axis=1)
+    df3['mined_value'] = df3['sell_price_avg'] * df3['qty']
     df3 = df3[['price_date', 'ore', 'sell_price_avg', 'mined_value']]
     df3.to_csv('data/mined_items_by_day.csv', index=False)
     df = df3.copy()
@@ -152,7 +151,7 @@ def get_jita_sell(item: pd.DataFrame) -> pd.DataFrame:
     ids = item['type_id'].unique().tolist()
     ids_str = ','.join(map(str, ids))
     url = f'{base_url}{regionid}&types={ids_str}'
-    response = requests.get(url)
+    response = governor.get(url, timeout=30)
     data = response.json()
     logger.info('got jita prices. parsing json to df')
     df = pd.DataFrame(parse_json(data))
@@ -1,8 +1,11 @@
 
 import gspread
 import pandas as pd
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.service_account import Credentials
 
+import http_client
+
 from sql_handler import read_sql_market_stats, read_sql_watchlist
 import logging_tool
 
@@ -18,8 +21,9 @@ def get_credentials(SCOPES: list):
     credentials = Credentials.from_service_account_file(
         SERVICE_ACCOUNT_FILE, scopes=SCOPES
     )
-    # Step 2: Connect to Google Sheets
-    gc = gspread.authorize(credentials)
+    # Step 2: Connect to Google Sheets, reusing the pooled connections from http_client
+    session = http_client.mount(AuthorizedSession(credentials))
+    gc = gspread.Client(credentials, session=session)
     return gc
 
 
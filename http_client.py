@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+import logging_tool
+
+logger = logging_tool.configure_logging(log_name=__name__)
+
+# ---------------------------------------------
+# Pooled HTTP client
+# ---------------------------------------------
+# One requests session for every outbound call (ESI, Fuzzwork, adam4eve, eve-kill and Sheets), so
+# connections are kept alive and reused instead of paying a TCP+TLS handshake per request.
+# The adapter limits how many requests can be in flight per host and records metrics, including
+# how many connections were opened and how long the handshakes took.
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_HOST_LIMIT = 10
+HOST_LIMITS = {
+    "esi.evetech.net": 20,
+    "market.fuzzwork.co.uk": 4,
+    "api.adam4eve.eu": 4,
+    "eve-kill.com": 2,
+}
+POOL_MAXSIZE = 20
+
+
+class HttpMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hosts = defaultdict(lambda: {"requests": 0, "errors": 0, "bytes": 0, "seconds": 0.0,
+                                          "connections": 0, "connect_seconds": 0.0})
+
+    def record_connect(self, host: str, seconds: float):
+        with self._lock:
+            self.hosts[host]["connections"] += 1
+            self.hosts[host]["connect_seconds"] += seconds
+
+    def record_request(self, host: str, seconds: float, status: int | None, size: int):
+        with self._lock:
+            stats = self.hosts[host]
+            stats["requests"] += 1
+            stats["seconds"] += seconds
+            stats["bytes"] += size
+            if status is None or status >= 400:
+                stats["errors"] += 1
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {host: dict(stats) for host, stats in self.hosts.items()}
+
+    def reset(self):
+        with self._lock:
+            self.hosts.clear()
+
+
+metrics = HttpMetrics()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        metrics.record_connect(self.host, time.perf_counter() - start)
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    # includes the TLS handshake
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        metrics.record_connect(self.host, time.perf_counter() - start)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """Keep-alive adapter with per-host concurrency limits, a default timeout and metrics."""
+
+    def __init__(self, host_limits: dict | None = None, default_limit: int = DEFAULT_HOST_LIMIT,
+                 timeout: float = DEFAULT_TIMEOUT, pool_maxsize: int = POOL_MAXSIZE):
+        self.host_limits = HOST_LIMITS if host_limits is None else host_limits
+        self.default_limit = default_limit
+        self.timeout = timeout
+        self._semaphores = {}
+        self._semaphores_lock = threading.Lock()
+        super().__init__(pool_connections=10, pool_maxsize=pool_maxsize, pool_block=False)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool,
+                                                   "https": TimedHTTPSConnectionPool}
+
+    def _semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._semaphores_lock:
+            if host not in self._semaphores:
+                limit = self.host_limits.get(host, self.default_limit)
+                self._semaphores[host] = threading.BoundedSemaphore(limit)
+            return self._semaphores[host]
+
+    def send(self, request, timeout=None, **kwargs):
+        host = urlparse(request.url).hostname or ""
+        if timeout is None:
+            timeout = self.timeout
+        start = time.perf_counter()
+        with self._semaphore(host):
+            try:
+                response = super().send(request, timeout=timeout, **kwargs)
+            except requests.RequestException:
+                metrics.record_request(host, time.perf_counter() - start, None, 0)
+                raise
+        # bytes on the wire, i.e. compressed size when the server gzipped the body
+        size = int(response.headers.get("Content-Length", 0) or 0)
+        metrics.record_request(host, time.perf_counter() - start, response.status_code, size)
+        return response
+
+
+def mount(session: requests.Session, adapter: PooledAdapter | None = None) -> requests.Session:
+    # puts the pooled adapter on an existing session, e.g. the authorized session used by gspread
+    adapter = adapter or _adapter
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.setdefault("Accept-Encoding", "gzip, deflate")
+    return session
+
+
+def log_summary():
+    # prints and logs per-host request and handshake timings for the run
+    for host, stats in metrics.summary().items():
+        requests_made = stats["requests"] or 1
+        connections = stats["connections"] or 1
+        line = (f"{host}: {stats['requests']} requests, {stats['errors']} errors, "
+                f"{stats['bytes'] / 1024:.0f} KB, avg {stats['seconds'] / requests_made * 1000:.0f} ms/request, "
+                f"{stats['connections']} connections opened, "
+                f"avg handshake {stats['connect_seconds'] / connections * 1000:.0f} ms "
+                f"({stats['connect_seconds']:.2f}s total)")
+        print(line)
+        logger.info(line)
+
+
+_adapter = PooledAdapter()
+session = mount(requests.Session())
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    return session.request(method, url, **kwargs)
@@ -4,11 +4,11 @@ from logging import Formatter, basicConfig, StreamHandler
 from logging import getLogger, INFO, DEBUG, FileHandler
 
 import pandas as pd
-import requests
 from dateutil.relativedelta import relativedelta
 from sqlalchemy import create_engine, text
 
 import sql_handler
+from esi_governor import governor
 
 logger = getLogger('kc_log')
 logger.setLevel(INFO)
@@ -67,7 +67,7 @@ def frt_km_query(skip: int, date_after) -> dict or None:
     }
 
     logger.info('sending request')
-    response = requests.post(url, headers=headers, json=payload)
+    response = governor.post(url, headers=headers, json=payload, timeout=30)
     status = response.headers
     logger.info(f'status: {status}')
 
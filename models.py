@@ -39,7 +39,7 @@ class MarketHistory(Base):
     __tablename__ = "market_history"
     date: Mapped[datetime] = mapped_column(DateTime)
     type_name: Mapped[Optional[str]] = mapped_column(String(100), nullable=True)
-    type_id: Mapped[str] = mapped_column(String(10))
+    type_id: Mapped[int] = mapped_column(Integer)
     average: Mapped[float] = mapped_column(Float)
     volume: Mapped[int] = mapped_column(Integer)
     highest: Mapped[float] = mapped_column(Float)
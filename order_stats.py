@@ -0,0 +1,292 @@
+import numpy as np
+import pandas as pd
+
+# ---------------------------------------------
+# Order book aggregation engine
+# ---------------------------------------------
+# Per-type stats for a book of orders in one pass: prices are sorted once by (type_id, price)
+# and every stat is read off the group boundaries with NumPy. This replaces three groupbys and two
+# merges in aggregate_sell_orders. Percentiles use the same linear interpolation as pandas'
+# quantile(), so the output matches the old pandas code.
+
+# average orders per group above which groups are sorted slice by slice
+SEGMENT_SORT_GROUP_SIZE = 64
+
+
+def group_codes(keys: list[np.ndarray]) -> tuple[np.ndarray, list[np.ndarray]]:
+    """Dense group codes that sort in key order, and the key values of each code.
+
+    Keys are hashed with pd.factorize rather than sorted, and multiple keys are combined into one
+    code, so the only sort left is the one by price.
+    """
+    codes = np.zeros(len(keys[0]), dtype=np.int64)
+    uniques = []
+    for key in keys:
+        key_codes, key_uniques = pd.factorize(key, sort=True)
+        codes = codes * len(key_uniques) + key_codes
+        uniques.append(np.asarray(key_uniques))
+    return codes, uniques
+
+
+def sort_by_group_and_price(codes: np.ndarray, prices: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Prices sorted by (group, price), without a lexsort.
+
+    NumPy radix-sorts 16 bit codes, so with fewer than 65536 groups sorting by group is linear.
+    Big groups (large books) are then sorted in place one slice at a time, which is much faster
+    than an argsort over every price; lots of small groups get one argsort by price up front instead.
+    """
+    if len(codes) and codes.max() < 2 ** 16:
+        codes = codes.astype(np.uint16)
+    if len(codes) < SEGMENT_SORT_GROUP_SIZE * np.count_nonzero(sizes):
+        by_price = np.argsort(prices)
+        return prices[by_price][np.argsort(codes[by_price], kind="stable")]
+
+    prices = prices[np.argsort(codes, kind="stable")]
+    ends = np.cumsum(sizes)
+    for start, end in zip((ends - sizes).tolist(), ends.tolist()):
+        if end - start > 1:
+            prices[start:end].sort()
+    return prices
+
+
+def sort_order_by_group_and_price(codes: np.ndarray, prices: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    # like sort_by_group_and_price, but returns the (stable) sorting permutation, for when other
+    # columns have to follow the prices
+    if len(codes) and codes.max() < 2 ** 16:
+        codes = codes.astype(np.uint16)
+    if len(codes) < SEGMENT_SORT_GROUP_SIZE * np.count_nonzero(sizes):
+        by_price = np.argsort(prices, kind="stable")
+        return by_price[np.argsort(codes[by_price], kind="stable")]
+
+    order = np.argsort(codes, kind="stable")
+    prices = prices[order]
+    ends = np.cumsum(sizes)
+    for start, end in zip((ends - sizes).tolist(), ends.tolist()):
+        if end - start > 1:
+            order[start:end] = order[start:end][np.argsort(prices[start:end], kind="stable")]
+    return order
+
+
+def sorted_quantile(values: np.ndarray, starts: np.ndarray, ends: np.ndarray, q: float) -> np.ndarray:
+    # linear-interpolated quantile of each group in values, which must be sorted within groups
+    pos = (ends - starts - 1) * q
+    lower = np.floor(pos).astype(np.int64)
+    frac = pos - lower
+    lo = values[starts + lower]
+    hi = values[np.minimum(starts + lower + 1, ends - 1)]
+    return lo + (hi - lo) * frac
+
+
+def sorted_groups(orders: pd.DataFrame, by: list[str]) -> tuple[dict, np.ndarray, np.ndarray, np.ndarray]:
+    """The sorted pass shared by the stats functions.
+
+    Returns the group key columns and total_volume_remain (one row per group, in groupby order),
+    the prices sorted by (group, price), and each group's start and end in them.
+    """
+    prices = orders["price"].to_numpy(dtype=np.float64)
+    volumes = orders["volume_remain"].to_numpy()
+
+    codes, uniques = group_codes([orders[col].to_numpy() for col in by])
+    sizes = np.bincount(codes) if len(codes) else np.empty(0, dtype=np.int64)
+    prices = sort_by_group_and_price(codes, prices, sizes)
+
+    # sorted groups are contiguous, so their bounds come straight from the group sizes.
+    # sums don't need the sort at all
+    present = np.flatnonzero(sizes)
+    counts = sizes[present]
+    ends = np.cumsum(counts)
+    starts = ends - counts
+    volume_sums = np.bincount(codes, weights=volumes, minlength=len(sizes))[present] if len(codes) else counts
+
+    stats = {}
+    # unpack the combined code back into the key columns
+    remaining = present
+    for col, key_uniques in reversed(list(zip(by, uniques))):
+        stats[col] = key_uniques[remaining % len(key_uniques)]
+        remaining = remaining // len(key_uniques)
+    stats = {col: stats[col] for col in by}
+    stats["total_volume_remain"] = volume_sums.astype(np.int64)
+    return stats, prices, starts, ends
+
+
+def sell_order_stats(orders: pd.DataFrame, by: list[str] | None = None, quantile: float = 0.05) -> pd.DataFrame:
+    """Aggregates sell orders per type (or per `by` columns) in one sorted pass.
+
+    Returns one row per group with total_volume_remain, min_price and price_5th_percentile,
+    sorted by the group columns like a groupby would be.
+    """
+    by = by or ["type_id"]
+    stats, prices, starts, ends = sorted_groups(orders, by)
+    stats["min_price"] = prices[starts]
+    stats["price_5th_percentile"] = sorted_quantile(prices, starts, ends, quantile)
+    return pd.DataFrame(stats)
+
+
+def order_book_stats(orders: pd.DataFrame, quantile: float = 0.05, bid_quantile: float = 0.95) -> pd.DataFrame:
+    """sell_order_stats() plus the buy side, from one sorted pass over buy and sell orders.
+
+    One row per type with sell orders, sorted by type_id. The buy side adds max_bid, bid_volume,
+    bid_95th_percentile and spread (min_price - max_bid). Types without buy orders get
+    bid_volume 0 and NaN for the rest.
+    """
+    # grouping on the side as well puts each type's sells and buys next to each other in the sort
+    book, prices, starts, ends = sorted_groups(orders, ["type_id", "is_buy_order"])
+    is_buy = book["is_buy_order"].astype(bool)
+    sells, buys = ~is_buy, is_buy
+
+    type_ids = book["type_id"][sells]
+    stats = {
+        "type_id": type_ids,
+        "total_volume_remain": book["total_volume_remain"][sells],
+        "min_price": prices[starts[sells]],
+        "price_5th_percentile": sorted_quantile(prices, starts[sells], ends[sells], quantile),
+    }
+
+    # line the buy groups up with the sell rows. Both are sorted by type_id
+    pos = np.searchsorted(type_ids, book["type_id"][buys])
+    found = pos < len(type_ids)
+    found[found] = type_ids[pos[found]] == book["type_id"][buys][found]
+    pos = pos[found]
+
+    max_bid = np.full(len(type_ids), np.nan)
+    bid_percentile = np.full(len(type_ids), np.nan)
+    bid_volume = np.zeros(len(type_ids), dtype=np.int64)
+    max_bid[pos] = prices[ends[buys][found] - 1]
+    bid_percentile[pos] = sorted_quantile(prices, starts[buys][found], ends[buys][found], bid_quantile)
+    bid_volume[pos] = book["total_volume_remain"][buys][found]
+
+    stats["max_bid"] = max_bid
+    stats["bid_volume"] = bid_volume
+    stats["bid_95th_percentile"] = bid_percentile
+    stats["spread"] = stats["min_price"] - max_bid
+    return pd.DataFrame(stats)
+
+
+# ---------------------------------------------
+# Order book depth
+# ---------------------------------------------
+# What it costs to actually buy N units: walk up each type's sell orders from the cheapest,
+# taking each order's volume in turn. The ladders are built once for the whole book and every
+# (type_id, N) request is answered with a binary search, so many requests cost one call.
+
+def sell_ladder(orders: pd.DataFrame) -> pd.DataFrame:
+    """Sell orders sorted by (type_id, price) with running totals per type.
+
+    cum_volume and cum_cost are the units and ISK needed to buy out that order and every cheaper one.
+    """
+    # typed up front: an empty book read from SQL comes back with object columns
+    orders = orders[["type_id", "price", "volume_remain"]].astype(
+        {"type_id": np.int64, "price": np.float64, "volume_remain": np.int64})
+    codes, _ = group_codes([orders["type_id"].to_numpy()])
+    sizes = np.bincount(codes) if len(codes) else np.empty(0, dtype=np.int64)
+    order = sort_order_by_group_and_price(codes, orders["price"].to_numpy(), sizes)
+
+    ladder = orders.iloc[order].reset_index(drop=True)
+    codes = codes[order]
+    ladder["cum_volume"] = ladder["volume_remain"].groupby(codes).cumsum().to_numpy()
+    ladder["cum_cost"] = (ladder["price"] * ladder["volume_remain"]).groupby(codes).cumsum().to_numpy()
+    return ladder
+
+
+def buy_cost(orders: pd.DataFrame, requests: pd.DataFrame, ladder: pd.DataFrame | None = None) -> pd.DataFrame:
+    """Cost of buying requests["quantity"] units of each requests["type_id"] from the sell orders.
+
+    Returns the requests with filled (units available, at most quantity), total_cost,
+    avg_price (total_cost / filled) and marginal_price (the price of the last unit bought). If
+    fewer units are listed than asked for, these are for buying out the book. Types with no
+    orders get filled 0 and NaN prices. Pass a ladder from sell_ladder() to reuse it.
+    """
+    ladder = sell_ladder(orders) if ladder is None else ladder
+    result = requests[["type_id", "quantity"]].reset_index(drop=True).copy()
+    if ladder.empty:
+        return result.assign(filled=0, total_cost=0.0, avg_price=np.nan, marginal_price=np.nan)
+
+    type_ids = ladder["type_id"].to_numpy()
+    prices = ladder["price"].to_numpy(dtype=np.float64)
+    volumes = ladder["volume_remain"].to_numpy(dtype=np.int64)
+    cum_cost = ladder["cum_cost"].to_numpy(dtype=np.float64)
+    # running volume over the whole book is increasing, so one searchsorted finds every fill
+    book_volume = np.cumsum(volumes)
+
+    wanted = requests["type_id"].to_numpy()
+    quantity = requests["quantity"].to_numpy(dtype=np.int64)
+    starts = np.searchsorted(type_ids, wanted, side="left")
+    ends = np.searchsorted(type_ids, wanted, side="right")
+    listed = ends > starts
+
+    base = np.where(starts > 0, book_volume[np.maximum(starts - 1, 0)], 0)
+    available = np.where(listed, book_volume[np.maximum(ends - 1, 0)] - base, 0)
+    filled = np.clip(quantity, 0, available)
+
+    # the order the last unit comes from, and what the orders before it cost
+    last = np.searchsorted(book_volume, base + filled, side="left")
+    last = np.minimum(np.clip(last, starts, np.maximum(ends - 1, starts)), len(prices) - 1)
+    has_fill = listed & (filled > 0)
+    earlier = has_fill & (last > starts)
+    before = np.maximum(last - 1, 0)
+    cost_before = np.where(earlier, cum_cost[before], 0.0)
+    volume_before = np.where(earlier, book_volume[before], base)
+    marginal = np.where(has_fill, prices[last], np.nan)
+    total_cost = np.where(has_fill, cost_before + (base + filled - volume_before) * marginal, 0.0)
+
+    result["filled"] = filled
+    result["total_cost"] = total_cost
+    with np.errstate(invalid="ignore", divide="ignore"):
+        result["avg_price"] = np.where(has_fill, total_cost / filled, np.nan)
+    result["marginal_price"] = marginal
+    return result
+
+
+def depth_stats(orders: pd.DataFrame, quantities: list[int], ladder: pd.DataFrame | None = None) -> pd.DataFrame:
+    """avg_price_<N> and marginal_price_<N> for every type in orders and each N in quantities,
+    one row per type_id, sorted by type_id."""
+    ladder = sell_ladder(orders) if ladder is None else ladder
+    type_ids = ladder["type_id"].unique()
+    stats = pd.DataFrame({"type_id": type_ids})
+    for quantity in quantities:
+        cost = buy_cost(orders, pd.DataFrame({"type_id": type_ids, "quantity": quantity}), ladder)
+        stats[f"avg_price_{quantity}"] = cost["avg_price"].to_numpy()
+        stats[f"marginal_price_{quantity}"] = cost["marginal_price"].to_numpy()
+    return stats
+
+
+# ---------------------------------------------
+# Volume-weighted percentiles
+# ---------------------------------------------
+# price_5th_percentile counts orders, so a 1 unit order weighs as much as a 10000 unit one. These
+# count units instead: the q percentile is the price of the unit q of the way up the ladder, the
+# first order where the running volume reaches q * total volume (numpy's "inverted_cdf" method
+# with volume weights). Every percentile of every type is one binary search on the same ladder.
+
+def weighted_quantile_column(quantile: float) -> str:
+    # 0.05 -> weighted_price_5, 0.025 -> weighted_price_2_5
+    return f"weighted_price_{quantile * 100:g}".replace(".", "_")
+
+
+def weighted_quantiles(orders: pd.DataFrame, quantiles: list[float],
+                       ladder: pd.DataFrame | None = None) -> pd.DataFrame:
+    """Volume-weighted price percentiles of the sell orders, one row per type_id (sorted) and a
+    weighted_quantile_column() column per quantile. Types with no volume listed get NaN.
+    Pass a ladder from sell_ladder() to share it with depth_stats()."""
+    ladder = sell_ladder(orders) if ladder is None else ladder
+    columns = [weighted_quantile_column(quantile) for quantile in quantiles]
+    if ladder.empty:
+        return pd.DataFrame({"type_id": np.empty(0, dtype=np.int64), **{col: np.empty(0) for col in columns}})
+
+    type_ids = ladder["type_id"].to_numpy()
+    prices = ladder["price"].to_numpy(dtype=np.float64)
+    book_volume = np.cumsum(ladder["volume_remain"].to_numpy(dtype=np.int64))
+
+    # ladder rows are grouped by type, so each type is one run
+    starts = np.flatnonzero(np.r_[True, type_ids[1:] != type_ids[:-1]])
+    ends = np.r_[starts[1:], len(type_ids)]
+    base = np.where(starts > 0, book_volume[np.maximum(starts - 1, 0)], 0)
+    total = book_volume[ends - 1] - base
+
+    stats = {"type_id": type_ids[starts]}
+    for quantile, column in zip(quantiles, columns):
+        # the rank of the unit wanted, 1 to total. Rounded first so 0.07 * 100 is 7, not 8
+        rank = np.clip(np.ceil(np.round(quantile * total, 9)), 1, np.maximum(total, 1)).astype(np.int64)
+        pos = np.clip(np.searchsorted(book_volume, base + rank, side="left"), starts, ends - 1)
+        stats[column] = np.where(total > 0, prices[pos], np.nan)
+    return pd.DataFrame(stats)
@@ -0,0 +1,151 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+
+import logging_tool
+from esi_decode import frame_to_pandas
+
+logger = logging_tool.configure_logging(log_name=__name__)
+
+# ---------------------------------------------
+# Polars stats engine (--engine polars)
+# ---------------------------------------------
+# Runs the market stats stages (aggregate_sell_orders, history_merge, merge_market_stats and the
+# history lookups in fill_missing_stats_v2) as lazy polars queries collected together, so polars
+# can run them on every core and share the common parts of the plan. The output matches the
+# pandas code: same rows, columns, order and values. pandas is still the default engine.
+#
+# The 30 day history averages come from the history_rollup table (shared_utils.read_history_means),
+# the same frame the pandas code uses, so both engines start from the same numbers.
+
+# columns fill_missing_stats_v2 adds to the watchlist rows of items that have no sell orders
+missing_stats_columns = ['type_id', 'total_volume_remain', 'min_price', 'price_5th_percentile',
+                         'avg_of_avg_price', 'avg_daily_volume', 'group_id', 'type_name',
+                         'group_name', 'category_id', 'category_name', 'days_remaining', 'timestamp']
+
+
+def to_polars(df: pd.DataFrame) -> pl.DataFrame:
+    # column by column through numpy, like frame_to_pandas, so pyarrow isn't needed
+    columns = {}
+    for name in df.columns:
+        values = df[name]
+        if values.dtype == object:
+            values = values.astype(object).where(values.notna(), None).tolist()
+            columns[name] = pl.Series(name, values, strict=False)
+        else:
+            columns[name] = pl.Series(name, values.to_numpy())
+    return pl.DataFrame(columns)
+
+
+def sell_stats_plan(orders: pl.LazyFrame, ids: list, quantile: float = 0.05,
+                    bid_quantile: float = 0.95) -> pl.LazyFrame:
+    # aggregate_sell_orders: sell order stats per watchlist type, with the buy side alongside.
+    # one group_by over both sides, keeping the types that have sell orders
+    sell = pl.col("is_buy_order") == False
+    buy = pl.col("is_buy_order") == True
+    return (
+        orders.filter(pl.col("type_id").is_in(ids))
+        .group_by("type_id")
+        .agg(
+            pl.col("volume_remain").filter(sell).sum().alias("total_volume_remain"),
+            pl.col("price").filter(sell).min().alias("min_price"),
+            pl.col("price").filter(sell).quantile(quantile, interpolation="linear").alias("price_5th_percentile"),
+            pl.col("price").filter(buy).max().alias("max_bid"),
+            pl.col("volume_remain").filter(buy).sum().alias("bid_volume"),
+            pl.col("price").filter(buy).quantile(bid_quantile, interpolation="linear").alias("bid_95th_percentile"),
+        )
+        .filter(pl.col("min_price").is_not_null())
+        .with_columns((pl.col("min_price") - pl.col("max_bid")).alias("spread"))
+        .sort("type_id")
+    )
+
+
+def round_like_pandas(expr: pl.Expr, decimals: int) -> pl.Expr:
+    # rounds with numpy, as pandas does. polars' round() differs on halves, and dividing by a
+    # scalar in polars isn't always exact either, so the numpy steps can't be rebuilt as expressions
+    return expr.map_batches(lambda s: pl.Series(s.name, np.round(s.to_numpy(), decimals)), return_dtype=pl.Float64)
+
+
+def history_stats(history_means: pl.LazyFrame) -> pl.LazyFrame:
+    # history_merge: 30 day averages per type, rounded to 2 places
+    return history_means.with_columns(round_like_pandas(pl.col("avg_of_avg_price"), 2),
+                                      round_like_pandas(pl.col("avg_daily_volume"), 2))
+
+
+def market_stats_plan(sell_stats: pl.LazyFrame, history_stats: pl.LazyFrame,
+                      watchlist: pl.LazyFrame) -> pl.LazyFrame:
+    # merge_market_stats: sell stats joined to history and the watchlist, plus days_remaining
+    avg_daily_volume = pl.col("avg_daily_volume")
+    return (
+        sell_stats.join(history_stats, on="type_id", how="left")
+        .join(watchlist, on="type_id", how="left")
+        .sort("type_id", maintain_order=True)
+        .with_columns(
+            round_like_pandas(
+                pl.when(avg_daily_volume == 0).then(0.0).otherwise(pl.col("total_volume_remain") / avg_daily_volume),
+                1,
+            ).alias("days_remaining")
+        )
+    )
+
+
+def missing_stats_plan(sell_stats: pl.LazyFrame, watchlist: pl.LazyFrame,
+                       history_means: pl.LazyFrame) -> pl.LazyFrame:
+    """Rows fill_missing_stats_v2 adds for watchlist items without sell orders.
+
+    Same columns and order as the pandas version. Nulls are left for fill_missing_stats() to zero,
+    since pandas fills every column, strings included.
+    """
+    watchlist_columns = watchlist.collect_schema().names()
+    extra = [col for col in missing_stats_columns if col not in watchlist_columns]
+    return (
+        watchlist.with_row_index("row")
+        .join(sell_stats.select("type_id"), on="type_id", how="anti")
+        .join(history_means, on="type_id", how="left")
+        .sort("row")
+        .with_columns(
+            pl.lit(0, dtype=pl.Int64).alias("total_volume_remain"),
+            *[pl.lit(None, dtype=pl.Float64).alias(col) for col in extra
+              if col not in ("total_volume_remain", "avg_of_avg_price", "avg_daily_volume")],
+        )
+        .select(watchlist_columns + extra)
+    )
+
+
+def _to_pandas(frame: pl.DataFrame) -> pd.DataFrame:
+    df = frame_to_pandas(frame)
+    # pandas merges leave NaN, not None, in text columns
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].fillna(np.nan)
+    return df
+
+
+def market_stats(orders: pd.DataFrame, history_means: pd.DataFrame, watchlist: pd.DataFrame, ids: list,
+                 ladder_stats: pd.DataFrame | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Runs the stats stages on the watchlist orders (both sides). Returns the merge_market_stats
+    frame and the rows fill_missing_stats_v2 would add, both as pandas.
+
+    history_means is the unrounded 30 day averages from shared_utils.read_history_means().
+    ladder_stats (the depth and weighted percentile columns from MarketStructures8.ladder_stats)
+    is joined on after the sell stats, as aggregate_sell_orders does.
+    """
+    watchlist_lf = to_polars(watchlist).lazy().with_columns(pl.col("type_id").cast(pl.Int64))
+    history_lf = to_polars(history_means).lazy()
+    sell_stats = sell_stats_plan(to_polars(orders).lazy(), ids)
+    if ladder_stats is not None:
+        sell_stats = sell_stats.join(to_polars(ladder_stats).lazy(), on="type_id", how="left")
+    # both plans in one multi-threaded pass, sharing the sell stats
+    final, missing = pl.collect_all([
+        market_stats_plan(sell_stats, history_stats(history_lf), watchlist_lf),
+        missing_stats_plan(sell_stats, watchlist_lf, history_lf),
+    ])
+    logger.info(f"polars engine: {final.height} stats rows, {missing.height} missing items | market_stats()")
+    return _to_pandas(final), _to_pandas(missing)
+
+
+def fill_missing_stats(stats: pd.DataFrame, missing: pd.DataFrame) -> pd.DataFrame:
+    # the last step of fill_missing_stats_v2, with the missing rows from market_stats()
+    print(f'found missing items: {len(missing)}. Filling from history data.')
+    missing = missing.infer_objects().fillna(0)
+    updated_df = pd.concat([stats, missing]).infer_objects()
+    return updated_df.drop_duplicates()
@@ -0,0 +1,95 @@
+import os
+from datetime import datetime, timezone
+
+import polars as pl
+from sqlalchemy import create_engine
+
+import logging_tool
+
+logger = logging_tool.configure_logging(log_name=__name__)
+
+# ---------------------------------------------
+# Order book snapshot archive
+# ---------------------------------------------
+# Every order fetch is saved as a zstd-compressed parquet file, partitioned by day:
+#   data/snapshots/date=2025-06-23/orders_1035466617946_113005.parquet
+# Rows are sorted by type_id and written in small row groups, so load_book() can pull a few
+# type_ids out of a snapshot using the row group statistics instead of reading the whole file.
+
+mkt_sqlfile = "sqlite:///market_orders.sqlite"
+snapshot_dir = "data/snapshots"
+ROW_GROUP_SIZE = 10_000
+
+snapshot_schema = {
+    "type_id": pl.Int64,
+    "volume_remain": pl.Int64,
+    "price": pl.Float64,
+    "issued": pl.Datetime("us"),
+    "duration": pl.Int64,
+    "order_id": pl.Int64,
+    "is_buy_order": pl.Boolean,
+}
+
+
+def snapshot_path(structure_id: int, ts: datetime, directory: str = snapshot_dir) -> str:
+    day = os.path.join(directory, f"date={ts:%Y-%m-%d}")
+    return os.path.join(day, f"orders_{structure_id}_{ts:%H%M%S}.parquet")
+
+
+def write_snapshot(structure_id: int, ts: datetime | None = None, directory: str = snapshot_dir,
+                   database: str = mkt_sqlfile) -> str:
+    """Archives the current market_order table as a parquet snapshot. Returns the file path."""
+    ts = ts or datetime.now(timezone.utc)
+    engine = create_engine(database, echo=False)
+    query = "SELECT type_id, volume_remain, price, issued, duration, order_id, is_buy_order FROM market_order"
+    book = pl.read_database(query, connection=engine)
+
+    book = book.with_columns(
+        pl.col("issued").cast(pl.String).str.to_datetime(strict=False, time_unit="us"),
+        pl.col("is_buy_order").cast(pl.Boolean),
+    ).cast(snapshot_schema).sort(["type_id", "price"])
+
+    path = snapshot_path(structure_id, ts, directory)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    book.write_parquet(path, compression="zstd", statistics=True, row_group_size=ROW_GROUP_SIZE)
+    logger.info(f"archived {book.height} orders to {path} ({os.path.getsize(path) / 1024:.0f} KB)")
+    return path
+
+
+def list_snapshots(structure_id: int | None = None, directory: str = snapshot_dir) -> list[tuple[datetime, str]]:
+    # (snapshot time, path) for every snapshot, oldest first
+    snapshots = []
+    if not os.path.isdir(directory):
+        return snapshots
+    for day in os.listdir(directory):
+        if not day.startswith("date="):
+            continue
+        for name in os.listdir(os.path.join(directory, day)):
+            if not name.startswith("orders_") or not name.endswith(".parquet"):
+                continue
+            _, sid, hms = name[:-len(".parquet")].split("_")
+            if structure_id is not None and int(sid) != structure_id:
+                continue
+            ts = datetime.strptime(f"{day[5:]} {hms}", "%Y-%m-%d %H%M%S").replace(tzinfo=timezone.utc)
+            snapshots.append((ts, os.path.join(directory, day, name)))
+    return sorted(snapshots)
+
+
+def load_book(at: datetime, type_ids: list | None = None, structure_id: int | None = None,
+              directory: str = snapshot_dir) -> pl.DataFrame:
+    """Returns the order book as it was at time `at`, i.e. the latest snapshot taken at or before it.
+
+    Only the row groups that can hold the requested type_ids are read.
+    """
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)
+    candidates = [(ts, path) for ts, path in list_snapshots(structure_id, directory) if ts <= at]
+    if not candidates:
+        raise FileNotFoundError(f"no order book snapshot at or before {at}")
+    ts, path = candidates[-1]
+
+    book = pl.scan_parquet(path)
+    if type_ids is not None:
+        book = book.filter(pl.col("type_id").is_in([int(t) for t in type_ids]))
+    logger.info(f"loading book at {at} from snapshot {path}")
+    return book.with_columns(pl.lit(ts).alias("snapshot_time")).collect()
@@ -1,9 +1,11 @@
 import logging
 import os
+from contextlib import contextmanager
 from datetime import datetime, timezone
 from typing import List
 
 import pandas as pd
+import polars as pl
 from matplotlib import pyplot as plt
 from matplotlib.ticker import FuncFormatter
 from sqlalchemy import create_engine, text
@@ -11,7 +13,8 @@ from sqlalchemy.orm import declarative_base
 
 import logging_tool
 from data_mapping import remap_reversable, reverse_remap
-from shared_utils import read_doctrine_watchlist, get_doctrine_status_optimized
+from esi_decode import frame_to_pandas
+from shared_utils import read_doctrine_watchlist, get_doctrine_status_optimized, refresh_history_rollup
 from doctrine_monitor import export_doctrine_fits
 
 sql_logger = logging_tool.configure_logging(log_name=__name__)
@@ -198,35 +201,198 @@ def get_item_history(item_id: int, doys: int = 30) -> pd.DataFrame:
 
     return item_historydf
 
+# history dates are stored in one format, the one SQLAlchemy uses for DateTime on SQLite
+HISTORY_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+HISTORY_BATCH = 5000
+history_value_columns = ["type_name", "average", "volume", "highest", "lowest", "order_count", "timestamp"]
+
+
+def create_market_history(engine):
+    """Makes sure market_history exists with its (date, type_id) primary key.
+
+    Older databases have a market_history written by to_sql, with no key and mixed date formats.
+    That table is migrated once: dates are normalised and duplicate days keep the newest row.
+    """
+    with engine.begin() as conn:
+        columns = conn.execute(text("PRAGMA table_info(market_history)")).fetchall()
+        keyed = any(col[5] for col in columns)
+        if columns and keyed:
+            return
+        if columns:
+            sql_logger.info("migrating market_history to a keyed table")
+            conn.execute(text("ALTER TABLE market_history RENAME TO market_history_old"))
+        conn.execute(text("""
+            CREATE TABLE market_history (
+                date        DATETIME NOT NULL,
+                type_name   VARCHAR(100),
+                type_id     INTEGER NOT NULL,
+                average     FLOAT,
+                volume      INTEGER,
+                highest     FLOAT,
+                lowest      FLOAT,
+                order_count INTEGER,
+                timestamp   DATETIME,
+                PRIMARY KEY (date, type_id)
+            )
+        """))
+        if columns:
+            conn.execute(text("""
+                INSERT OR REPLACE INTO market_history
+                    (date, type_name, type_id, average, volume, highest, lowest, order_count, timestamp)
+                SELECT strftime('%Y-%m-%d 00:00:00.000000', date), type_name, CAST(type_id AS INTEGER),
+                       average, volume, highest, lowest, order_count, timestamp
+                FROM market_history_old
+                WHERE date IS NOT NULL AND type_id IS NOT NULL
+                ORDER BY rowid
+            """))
+            conn.execute(text("DROP TABLE market_history_old"))
+
+
+def upsert_history(df: pd.DataFrame, engine=None) -> int:
+    """Writes history rows with INSERT ... ON CONFLICT DO UPDATE, in batches.
+
+    Stored days that haven't changed are left alone, so the write cost follows the new and
+    revised days rather than the size of the fetch. Returns the number of rows written.
+    """
+    engine = engine or create_engine(mkt_sqlfile, echo=False)
+    create_market_history(engine)
+
+    rows = df[["date", "type_id"] + history_value_columns].copy()
+    rows["date"] = pd.to_datetime(rows["date"], errors="coerce").dt.strftime(HISTORY_DATE_FORMAT)
+    rows = rows.dropna(subset=["date", "type_id"])
+    rows["type_id"] = rows["type_id"].astype("int64")
+    rows["timestamp"] = pd.to_datetime(rows["timestamp"], utc=True).dt.strftime(HISTORY_DATE_FORMAT)
+    rows = rows.astype(object).where(rows.notna(), None)
+
+    stmt = text("""
+        INSERT INTO market_history (date, type_name, type_id, average, volume, highest, lowest, order_count, timestamp)
+        VALUES (:date, :type_name, :type_id, :average, :volume, :highest, :lowest, :order_count, :timestamp)
+        ON CONFLICT (date, type_id) DO UPDATE SET
+            type_name = excluded.type_name,
+            average = excluded.average,
+            volume = excluded.volume,
+            highest = excluded.highest,
+            lowest = excluded.lowest,
+            order_count = excluded.order_count,
+            timestamp = excluded.timestamp
+        WHERE market_history.average IS NOT excluded.average
+           OR market_history.volume IS NOT excluded.volume
+           OR market_history.highest IS NOT excluded.highest
+           OR market_history.lowest IS NOT excluded.lowest
+           OR market_history.order_count IS NOT excluded.order_count
+           OR market_history.type_name IS NOT excluded.type_name
+    """)
+    records = rows.to_dict("records")
+    written = 0
+    with engine.begin() as conn:
+        before = conn.execute(text("SELECT total_changes()")).scalar()
+        for i in range(0, len(records), HISTORY_BATCH):
+            conn.execute(stmt, records[i:i + HISTORY_BATCH])
+        written = conn.execute(text("SELECT total_changes()")).scalar() - before
+    return written
+
+
 def update_history(df: pd.DataFrame) -> str:
+    # history is kept indefinitely; each refresh only adds new days and fixes revised ones
     engine = create_engine(mkt_sqlfile, echo=False)
 
     optimize_for_bulk_update(engine)
 
-    with engine.connect() as con:
-        try:
-            df_processed = process_pd_dataframe(df, history_columns)
-            status = "data processed"
-        except Exception as e:
-            sql_logger.error(print(f'an exception occurred in process_pd_dataframe(df, history_columns): {e}'))
-            raise
-        try:
-            df_named = insert_pd_type_names(df_processed)
-            status += ", type names updated"
-        except Exception as e:
-            sql_logger.error(print(f'an exception occurred in insert_pd_type_names(df_processed): {e}'))
-            raise
-        try:
-            df_named.to_sql('market_history', con=engine, if_exists='replace', index=False, chunksize=1000)
-            status += ", data loaded"
-        except Exception as e:
-            sql_logger.error(print(f'an exception occurred in df_processed.to_sql: {e}'))
-            raise
-
-    revert_sqlite_settings(engine)
+    try:
+        df_processed = process_pd_dataframe(df, history_columns)
+        status = "data processed"
+    except Exception as e:
+        sql_logger.error(print(f'an exception occurred in process_pd_dataframe(df, history_columns): {e}'))
+        raise
+    try:
+        df_named = insert_pd_type_names(df_processed)
+        status += ", type names updated"
+    except Exception as e:
+        sql_logger.error(print(f'an exception occurred in insert_pd_type_names(df_processed): {e}'))
+        raise
+    try:
+        written = upsert_history(df_named, engine)
+        status += f", {written} of {len(df_named)} rows new or changed"
+    except Exception as e:
+        sql_logger.error(print(f'an exception occurred in upsert_history(df_named): {e}'))
+        raise
+    finally:
+        revert_sqlite_settings(engine)
 
+    # the 30 day averages of the items written, for the market stats
+    if written:
+        status += f", {refresh_history_rollup(df_named['type_id'].unique().tolist())}"
     return status
 
+
+def create_history_refresh(engine):
+    # the last day each type_id's history was checked through, including days with no trades
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS history_refresh (
+                type_id         BIGINT PRIMARY KEY,
+                checked_through TEXT,
+                updated         TEXT
+            )
+        """))
+
+
+def read_history_progress() -> dict:
+    """Returns {type_id: date} for the newest day each type's history is known to be complete for.
+
+    That is the later of the newest stored row and the last time the type was checked, since ESI
+    leaves out days with no trades.
+    """
+    engine = create_engine(mkt_sqlfile, echo=False)
+    create_history_refresh(engine)
+    with engine.connect() as conn:
+        has_history = conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'market_history'")
+        ).fetchone()
+        stored = "SELECT type_id, date(date) AS day FROM market_history UNION ALL " if has_history else ""
+        rows = conn.execute(text(f"""
+            SELECT type_id, MAX(day) FROM (
+                {stored}SELECT type_id, checked_through AS day FROM history_refresh
+            ) GROUP BY type_id
+        """)).fetchall()
+    return {int(type_id): datetime.strptime(day, "%Y-%m-%d").date() for type_id, day in rows if day}
+
+
+def read_history_priority() -> pd.DataFrame:
+    """avg_daily_volume (from Market_Stats) and doctrine demand (units needed across doctrine fits,
+    from Doctrines) per type_id, for ranking history refreshes. Missing tables count as zero."""
+    engine = create_engine(mkt_sqlfile, echo=False)
+    with engine.connect() as conn:
+        tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        volume = pd.DataFrame(columns=["type_id", "avg_daily_volume"])
+        doctrine = pd.DataFrame(columns=["type_id", "doctrine_qty"])
+        if "Market_Stats" in tables:
+            volume = pd.read_sql(text("SELECT type_id, avg_daily_volume FROM Market_Stats"), conn)
+        if "Doctrines" in tables:
+            doctrine = pd.read_sql(text("SELECT type_id, SUM(qty) AS doctrine_qty FROM Doctrines GROUP BY type_id"), conn)
+    for df in (volume, doctrine):
+        df["type_id"] = pd.to_numeric(df["type_id"], errors="coerce")
+    priority = volume.dropna(subset=["type_id"]).merge(doctrine.dropna(subset=["type_id"]), on="type_id", how="outer")
+    priority["type_id"] = priority["type_id"].astype("int64")
+    return priority.fillna(0)
+
+
+def mark_history_checked(type_ids: list, through) -> None:
+    if not type_ids:
+        return
+    engine = create_engine(mkt_sqlfile, echo=False)
+    create_history_refresh(engine)
+    now = datetime.now(timezone.utc).isoformat()
+    with engine.begin() as conn:
+        conn.execute(
+            text("""
+                INSERT INTO history_refresh (type_id, checked_through, updated) VALUES (:type_id, :through, :updated)
+                ON CONFLICT(type_id) DO UPDATE SET checked_through = excluded.checked_through, updated = excluded.updated
+            """),
+            [{"type_id": int(t), "through": through.isoformat(), "updated": now} for t in type_ids],
+        )
+
+
 def update_orders(df: pd.DataFrame) -> str:
     sql_logger.info("updating orders...initiating engine")
     engine = create_engine(mkt_sqlfile, echo=False)
@@ -258,6 +424,328 @@ def update_orders(df: pd.DataFrame) -> str:
 
     return status
 
+# market orders are streamed page by page into a staging table and swapped into market_order at
+# the end of the fetch, so we never hold the whole order book in memory
+order_staging_table = "market_order_staging"
+order_table_columns = ["type_id", "type_name", "volume_remain", "price", "issued",
+                       "duration", "order_id", "is_buy_order", "timestamp"]
+
+
+def begin_order_staging(engine=None, reset: bool = True):
+    # reset=False keeps the pages already staged by an interrupted run
+    # pages are written with the normal journal and sync settings: the fetch takes minutes and a
+    # run killed part way must not leave a corrupt database behind
+    engine = engine or create_engine(mkt_sqlfile, echo=False)
+    with engine.begin() as conn:
+        if reset:
+            conn.execute(text(f"DROP TABLE IF EXISTS {order_staging_table}"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {order_staging_table} (
+                type_id       BIGINT,
+                volume_remain BIGINT,
+                price         FLOAT,
+                issued        DATETIME,
+                duration      BIGINT,
+                order_id      BIGINT,
+                is_buy_order  BOOLEAN,
+                timestamp     DATETIME
+            )
+        """))
+    sql_logger.info(f"{order_staging_table} ready")
+    return engine
+
+
+def process_order_page(orders, ts: datetime) -> pd.DataFrame:
+    """Validates and types one page of ESI orders. Rows missing an id or price are dropped.
+
+    Takes a page decoded by esi_decode (a polars frame) or a list of order dicts.
+    """
+    if isinstance(orders, pl.DataFrame):
+        df = frame_to_pandas(orders)[market_columns]
+    else:
+        df = pd.DataFrame(orders, columns=market_columns)
+    for col in ["type_id", "volume_remain", "duration", "order_id"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    df["price"] = pd.to_numeric(df["price"], errors="coerce")
+    df["issued"] = pd.to_datetime(df["issued"], errors="coerce")
+
+    invalid = df[["type_id", "order_id", "price", "volume_remain"]].isna().any(axis=1)
+    if invalid.any():
+        sql_logger.warning(f"dropping {invalid.sum()} invalid orders from page")
+        df = df[~invalid]
+
+    df = df.astype({"type_id": "int64", "volume_remain": "int64", "order_id": "int64",
+                    "price": "float64", "is_buy_order": "bool"})
+    df["duration"] = df["duration"].astype("Int64")
+    df["timestamp"] = ts
+    return df
+
+
+def stage_order_page(orders, ts: datetime, engine=None) -> int:
+    engine = engine or create_engine(mkt_sqlfile, echo=False)
+    df = process_order_page(orders, ts)
+    df.to_sql(order_staging_table, con=engine, if_exists="append", index=False, chunksize=1000)
+    return len(df)
+
+
+def create_order_changes(conn):
+    # log of what changed in market_order on each run, written by apply_staged_orders. A
+    # wholesale replace by swap_staged_orders is logged as a single 'replaced' row
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS order_changes (
+            order_id   BIGINT,
+            type_id    BIGINT,
+            change     TEXT,
+            old_price  FLOAT,
+            new_price  FLOAT,
+            old_volume BIGINT,
+            new_volume BIGINT,
+            timestamp  TEXT
+        )
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_changes_timestamp ON order_changes (timestamp)"))
+
+
+def swap_staged_orders(engine=None) -> str:
+    """Replaces market_order with the staged orders in one transaction, adding type names.
+
+    An order staged twice (a resumed run, or an order that moved pages mid-fetch) is kept once.
+    """
+    engine = engine or create_engine(mkt_sqlfile, echo=False)
+    with bulk_transaction(engine) as conn:
+        conn.execute(text("DROP TABLE IF EXISTS market_order_new"))
+        conn.execute(text("""
+            CREATE TABLE market_order_new (
+                type_id       BIGINT,
+                type_name     TEXT,
+                volume_remain BIGINT,
+                price         FLOAT,
+                issued        DATETIME,
+                duration      BIGINT,
+                order_id      BIGINT,
+                is_buy_order  BOOLEAN,
+                timestamp     DATETIME
+            )
+        """))
+        conn.execute(text(f"""
+            INSERT INTO market_order_new
+            SELECT s.type_id, j.typeName, s.volume_remain, s.price, s.issued,
+                   s.duration, s.order_id, s.is_buy_order, s.timestamp
+            FROM {order_staging_table} s
+            LEFT JOIN JoinedInvTypes j ON j.typeID = s.type_id
+            WHERE s.rowid IN (SELECT MAX(rowid) FROM {order_staging_table} GROUP BY order_id)
+        """))
+        count = conn.execute(text("SELECT COUNT(*) FROM market_order_new")).scalar()
+        conn.execute(text("DROP TABLE IF EXISTS market_order"))
+        conn.execute(text("ALTER TABLE market_order_new RENAME TO market_order"))
+        conn.execute(text(f"DROP TABLE {order_staging_table}"))
+        create_order_changes(conn)
+        conn.execute(text("INSERT INTO order_changes (change, timestamp) VALUES ('replaced', :ts)"),
+                     {"ts": datetime.now(timezone.utc).isoformat()})
+    sql_logger.info(f"swapped {count} staged orders into market_order")
+    return f"data processed, type names updated, {count} orders loaded"
+
+
+def apply_staged_orders(engine=None, complete: bool = True) -> dict:
+    """Diffs the staged orders against market_order on order_id and applies only the changes.
+
+    Every order is classified as new, price_changed, volume_changed or gone. The changes are
+    saved to order_changes under this run's timestamp and applied to market_order in place.
+    If the fetch was incomplete (failed pages) orders missing from the staging table may just be
+    on a page we didn't get, so nothing is marked gone. Falls back to swap_staged_orders when
+    there is no market_order table to diff against.
+    """
+    engine = engine or create_engine(mkt_sqlfile, echo=False)
+    with engine.connect() as conn:
+        columns = [row[1] for row in conn.execute(text("PRAGMA table_info(market_order)")).fetchall()]
+    if set(columns) != set(order_table_columns):
+        sql_logger.info(f"market_order missing or has a different schema ({columns}), replacing it")
+        return {"status": swap_staged_orders(engine)}
+
+    run_ts = datetime.now(timezone.utc).isoformat()
+    staged = order_staging_table
+    with bulk_transaction(engine) as conn:
+        # keep one row per order, then index both sides of the join
+        conn.execute(text(f"""
+            DELETE FROM {staged}
+            WHERE rowid NOT IN (SELECT MAX(rowid) FROM {staged} GROUP BY order_id)
+        """))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_staging_order_id ON {staged} (order_id)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_market_order_order_id ON market_order (order_id)"))
+        create_order_changes(conn)
+
+        conn.execute(text(f"""
+            INSERT INTO order_changes
+            SELECT s.order_id, s.type_id, 'new', NULL, s.price, NULL, s.volume_remain, :ts
+            FROM {staged} s LEFT JOIN market_order m ON m.order_id = s.order_id
+            WHERE m.order_id IS NULL
+        """), {"ts": run_ts})
+        conn.execute(text(f"""
+            INSERT INTO order_changes
+            SELECT s.order_id, s.type_id,
+                   CASE WHEN s.price <> m.price THEN 'price_changed' ELSE 'volume_changed' END,
+                   m.price, s.price, m.volume_remain, s.volume_remain, :ts
+            FROM {staged} s JOIN market_order m ON m.order_id = s.order_id
+            WHERE s.price <> m.price OR s.volume_remain <> m.volume_remain
+        """), {"ts": run_ts})
+        if complete:
+            conn.execute(text(f"""
+                INSERT INTO order_changes
+                SELECT m.order_id, m.type_id, 'gone', m.price, NULL, m.volume_remain, NULL, :ts
+                FROM market_order m LEFT JOIN {staged} s ON s.order_id = m.order_id
+                WHERE s.order_id IS NULL
+            """), {"ts": run_ts})
+
+        # apply the changes to market_order
+        conn.execute(text("""
+            DELETE FROM market_order WHERE order_id IN
+            (SELECT order_id FROM order_changes WHERE timestamp = :ts AND change = 'gone')
+        """), {"ts": run_ts})
+        conn.execute(text(f"""
+            UPDATE market_order
+            SET price = s.price, volume_remain = s.volume_remain, issued = s.issued,
+                duration = s.duration, timestamp = s.timestamp
+            FROM {staged} s
+            WHERE s.order_id = market_order.order_id AND market_order.order_id IN
+            (SELECT order_id FROM order_changes
+             WHERE timestamp = :ts AND change IN ('price_changed', 'volume_changed'))
+        """), {"ts": run_ts})
+        conn.execute(text(f"""
+            INSERT INTO market_order (type_id, type_name, volume_remain, price, issued,
+                                      duration, order_id, is_buy_order, timestamp)
+            SELECT s.type_id, j.typeName, s.volume_remain, s.price, s.issued,
+                   s.duration, s.order_id, s.is_buy_order, s.timestamp
+            FROM {staged} s LEFT JOIN JoinedInvTypes j ON j.typeID = s.type_id
+            WHERE s.order_id IN
+            (SELECT order_id FROM order_changes WHERE timestamp = :ts AND change = 'new')
+        """), {"ts": run_ts})
+
+        counts = dict(conn.execute(text("""
+            SELECT change, COUNT(*) FROM order_changes WHERE timestamp = :ts GROUP BY change
+        """), {"ts": run_ts}).fetchall())
+        conn.execute(text(f"DROP TABLE {staged}"))
+
+    counts = {change: counts.get(change, 0) for change in ["new", "price_changed", "volume_changed", "gone"]}
+    sql_logger.info(f"order changes applied to market_order: {counts}")
+    counts["status"] = f"order changes applied: {counts}"
+    counts["timestamp"] = run_ts
+    return counts
+
+
+def read_sell_orders(type_ids: list) -> pd.DataFrame:
+    # sell orders for the given type_ids only, so we don't load the whole order book
+    engine = create_engine(mkt_sqlfile, echo=False)
+    placeholders = ",".join([f":id{i}" for i in range(len(type_ids))])
+    params = {f"id{i}": int(value) for i, value in enumerate(type_ids)}
+    query = text(f"""
+        SELECT type_id, volume_remain, price, is_buy_order
+        FROM market_order
+        WHERE is_buy_order = 0 AND type_id IN ({placeholders})
+    """)
+    with engine.connect() as conn:
+        df = pd.read_sql(query, conn, params=params)
+    df["is_buy_order"] = df["is_buy_order"].astype(bool)
+    return df
+
+def read_book_orders(type_ids: list) -> pd.DataFrame:
+    # buy and sell orders for the given type_ids, for the stats that need both sides of the book
+    engine = create_engine(mkt_sqlfile, echo=False)
+    placeholders = ",".join([f":id{i}" for i in range(len(type_ids))])
+    params = {f"id{i}": int(value) for i, value in enumerate(type_ids)}
+    query = text(f"""
+        SELECT type_id, volume_remain, price, is_buy_order
+        FROM market_order
+        WHERE type_id IN ({placeholders})
+    """)
+    with engine.connect() as conn:
+        df = pd.read_sql(query, conn, params=params)
+    df["is_buy_order"] = df["is_buy_order"].astype(bool)
+    return df
+
+def create_structure_orders(engine):
+    # orders for the structures other than the primary one, which stays in market_order
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS structure_orders (
+                structure_id  BIGINT,
+                type_id       BIGINT,
+                volume_remain BIGINT,
+                price         FLOAT,
+                issued        DATETIME,
+                duration      BIGINT,
+                order_id      BIGINT,
+                is_buy_order  BOOLEAN,
+                timestamp     DATETIME
+            )
+        """))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_structure_orders ON structure_orders (structure_id, type_id)"
+        ))
+
+
+def update_structure_orders(structure_id: int, orders: pd.DataFrame, complete: bool = True) -> str:
+    """Saves one structure's orders to structure_orders in a single transaction.
+
+    A complete fetch replaces everything stored for the structure. After a partial fetch only the
+    orders that came back are replaced, and the rest are kept until the next full fetch.
+    """
+    engine = create_engine(mkt_sqlfile, echo=False)
+    create_structure_orders(engine)
+    df = process_order_page(orders, datetime.now(timezone.utc))
+    df.insert(0, "structure_id", int(structure_id))
+
+    with engine.begin() as conn:
+        if complete:
+            conn.execute(text("DELETE FROM structure_orders WHERE structure_id = :sid"), {"sid": int(structure_id)})
+        else:
+            conn.execute(text("CREATE TEMP TABLE refreshed_orders (order_id BIGINT PRIMARY KEY)"))
+            conn.execute(text("INSERT OR IGNORE INTO refreshed_orders VALUES (:order_id)"),
+                         [{"order_id": int(o)} for o in df["order_id"]])
+            conn.execute(text("""
+                DELETE FROM structure_orders
+                WHERE structure_id = :sid AND order_id IN (SELECT order_id FROM refreshed_orders)
+            """), {"sid": int(structure_id)})
+            conn.execute(text("DROP TABLE refreshed_orders"))
+        df.to_sql("structure_orders", con=conn, if_exists="append", index=False, chunksize=1000)
+
+    status = f"saved {len(df)} orders for structure {structure_id}" + ("" if complete else " (partial fetch)")
+    sql_logger.info(status)
+    return status
+
+
+def read_structure_sell_orders(type_ids: list) -> pd.DataFrame:
+    # watchlist sell orders from structure_orders, for every non-primary structure
+    engine = create_engine(mkt_sqlfile, echo=False)
+    create_structure_orders(engine)
+    placeholders = ",".join([f":id{i}" for i in range(len(type_ids))])
+    params = {f"id{i}": int(value) for i, value in enumerate(type_ids)}
+    query = text(f"""
+        SELECT structure_id, type_id, volume_remain, price, is_buy_order
+        FROM structure_orders
+        WHERE is_buy_order = 0 AND type_id IN ({placeholders})
+    """)
+    with engine.connect() as conn:
+        df = pd.read_sql(query, conn, params=params)
+    df["is_buy_order"] = df["is_buy_order"].astype(bool)
+    return df
+
+
+def update_structure_stats(df: pd.DataFrame) -> str:
+    # per (structure_id, type_id) stats for every structure. Market_Stats stays primary-only
+    engine = create_engine(mkt_sqlfile, echo=False)
+    df_processed = insert_pd_timestamp(df.infer_objects())
+    try:
+        with engine.begin() as conn:
+            df_processed.to_sql("structure_market_stats", con=conn, if_exists="replace", index=False,
+                                chunksize=1000)
+    except Exception as e:
+        sql_logger.error(f"Error occurred: {str(e)}")
+        raise
+    status = f"saved stats for {df['structure_id'].nunique()} structures ({len(df)} rows) to structure_market_stats"
+    sql_logger.info(status)
+    return status
+
+
 def update_stats(df: pd.DataFrame) -> str:
     df = df.infer_objects()
     df = df.fillna(0)
@@ -285,6 +773,100 @@ def update_stats(df: pd.DataFrame) -> str:
         sql_logger.error(f"Error occurred: {str(e)}")
         raise
 
+def read_order_changes(since: str | None = None) -> dict:
+    """type_ids with order changes logged after `since` (an order_changes timestamp).
+
+    Returns {"type_ids": set, "replaced": bool, "latest": newest timestamp or since}. replaced is
+    True if market_order was swapped out wholesale (or there is no change log), so every type
+    should be treated as changed.
+    """
+    engine = create_engine(mkt_sqlfile, echo=False)
+    with engine.connect() as conn:
+        has_log = conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'order_changes'")
+        ).fetchone()
+        if not has_log:
+            return {"type_ids": set(), "replaced": True, "latest": since}
+        rows = conn.execute(text("""
+            SELECT type_id, change, timestamp FROM order_changes WHERE timestamp > :since
+        """), {"since": since or ""}).fetchall()
+    type_ids = {int(type_id) for type_id, change, _ in rows if type_id is not None}
+    replaced = any(change == "replaced" for _, change, _ in rows)
+    latest = max([ts for _, _, ts in rows], default=since)
+    return {"type_ids": type_ids, "replaced": replaced, "latest": latest}
+
+
+def create_market_stats_state(engine):
+    # what the current Market_Stats rows were computed from, so the next run can update just the
+    # rows whose orders or history changed. one row
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS market_stats_state (
+                id             INTEGER PRIMARY KEY CHECK (id = 1),
+                watchlist      TEXT,
+                history_window TEXT,
+                order_changes  TEXT,
+                updated        TEXT
+            )
+        """))
+
+
+def read_market_stats_state() -> dict | None:
+    engine = create_engine(mkt_sqlfile, echo=False)
+    create_market_stats_state(engine)
+    with engine.connect() as conn:
+        row = conn.execute(text(
+            "SELECT watchlist, history_window, order_changes FROM market_stats_state WHERE id = 1"
+        )).fetchone()
+    if row is None:
+        return None
+    return {"watchlist": row[0], "history_window": row[1], "order_changes": row[2]}
+
+
+def save_market_stats_state(state: dict):
+    engine = create_engine(mkt_sqlfile, echo=False)
+    create_market_stats_state(engine)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO market_stats_state (id, watchlist, history_window, order_changes, updated)
+            VALUES (1, :watchlist, :history_window, :order_changes, :updated)
+            ON CONFLICT (id) DO UPDATE SET
+                watchlist = excluded.watchlist,
+                history_window = excluded.history_window,
+                order_changes = excluded.order_changes,
+                updated = excluded.updated
+        """), {**state, "updated": datetime.now(timezone.utc).isoformat()})
+
+
+def update_stats_rows(df: pd.DataFrame, type_ids: list) -> str:
+    """Rewrites only the Market_Stats rows for type_ids, from the matching rows of df. Only the
+    rewritten rows get this run's timestamp; the run time itself is kept in market_stats_state.
+    Types in type_ids with no row in df are deleted.
+
+    df must have the same columns as Market_Stats; use update_stats for a full rewrite.
+    """
+    df = df.infer_objects()
+    df = df.fillna(0)
+    df_processed = insert_pd_timestamp(df)
+    df_processed = df_processed[df_processed["type_id"].isin(type_ids)]
+
+    engine = create_engine(mkt_sqlfile, echo=False)
+    try:
+        with engine.begin() as conn:
+            for start in range(0, len(type_ids), 500):
+                batch = [int(type_id) for type_id in type_ids[start:start + 500]]
+                placeholders = ",".join([f":id{i}" for i in range(len(batch))])
+                conn.execute(text(f"DELETE FROM Market_Stats WHERE type_id IN ({placeholders})"),
+                             {f"id{i}": value for i, value in enumerate(batch)})
+            df_processed.to_sql('Market_Stats', conn, if_exists='append', index=False)
+    except Exception as e:
+        sql_logger.error(f"Error occurred: {str(e)}")
+        raise
+    status = f"updated {len(df_processed)} Market_Stats rows for {len(type_ids)} changed items"
+    sql_logger.info(status)
+    return status
+
+
 def optimize_for_bulk_update(engine):
     # Optimize database settings for bulk insert
     sql_logger.info('optimizing for bulk update')
@@ -298,6 +880,29 @@ def revert_sqlite_settings(engine):
         conn.execute(text("PRAGMA synchronous = FULL;"))
         conn.execute(text("PRAGMA journal_mode = DELETE;"))
 
+
+@contextmanager
+def bulk_transaction(engine):
+    """engine.begin() with the bulk update pragmas set for just this one transaction.
+
+    synchronous is per connection, so the pragmas are set, used and put back on the same
+    connection, and put back even if the transaction fails.
+    """
+    with engine.connect() as conn:
+        journal_mode = conn.execute(text("PRAGMA journal_mode")).scalar()
+        synchronous = conn.execute(text("PRAGMA synchronous")).scalar()
+        conn.execute(text("PRAGMA synchronous = OFF"))
+        conn.execute(text("PRAGMA journal_mode = MEMORY"))
+        conn.commit()
+        try:
+            with conn.begin():
+                yield conn
+        finally:
+            conn.rollback()
+            conn.execute(text(f"PRAGMA journal_mode = {journal_mode}"))
+            conn.execute(text(f"PRAGMA synchronous = {synchronous}"))
+            conn.commit()
+
 def read_sql_watchlist() -> pd.DataFrame:
     # grabs the current watchlist and returns it as a dataframe
     engine = create_engine(mkt_sqlfile, echo=False)
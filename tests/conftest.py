@@ -0,0 +1,74 @@
+import os
+import sys
+import tempfile
+import types
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules are flat files at the repo root, and they log to log_file/ and read data/ relative
+# to the working directory at import time. Tests run in a scratch directory, so they never touch
+# the real market_orders.sqlite or output files
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# the sheets, plotting and oauth packages are only touched at import time by the modules under
+# test. If they aren't installed, stand-ins are put in their place so the tests still run
+optional_modules = {
+    "gspread": [],
+    "google": ["google.auth", "google.auth.transport", "google.auth.transport.requests", "google.oauth2",
+               "google.oauth2.service_account"],
+    "matplotlib": ["matplotlib.pyplot", "matplotlib.ticker"],
+    "dotenv": [],
+    "requests_oauthlib": [],
+}
+for package, submodules in optional_modules.items():
+    try:
+        __import__(package)
+    except ImportError:
+        for name in [package, *submodules]:
+            stub = types.ModuleType(name)
+            stub.__path__ = []
+            stub.__getattr__ = lambda attr: mock.MagicMock(name=attr)
+            sys.modules[name] = stub
+
+workdir = Path(tempfile.mkdtemp(prefix="esimt_tests_"))
+for folder in ["log_file", "data", "output/latest", "output/brazil"]:
+    (workdir / folder).mkdir(parents=True, exist_ok=True)
+# get_jita_prices reads the mining basket when it is imported
+(workdir / "data" / "mining_basket.csv").write_text("type_id,Ore,Qty\n1230,Veldspar,1000\n1228,Scordite,250\n")
+os.chdir(workdir)
+
+
+@pytest.fixture
+def stats_env(monkeypatch):
+    # the stats pipeline on a synthetic book, with history and Jita prices stubbed out and
+    # Market_Stats in the scratch database
+    import MarketStructures8 as ms
+
+    rng = np.random.default_rng(7)
+    watchlist = pd.DataFrame({"type_id": np.arange(1, 61), "type_name": [f"item {i}" for i in range(1, 61)]})
+    n = 3000
+    book = pd.DataFrame({
+        "type_id": rng.integers(1, 50, n),
+        "volume_remain": rng.integers(1, 500, n),
+        "price": rng.uniform(1, 1000, n).round(2),
+        "is_buy_order": rng.random(n) < 0.2,
+    })
+    # some items with no buy orders, so their bid columns are NaN
+    book = book[~((book["type_id"] % 4 == 0) & book["is_buy_order"])].reset_index(drop=True)
+    # and some with no history. read_history_means is unrounded, the engines round it
+    history = pd.DataFrame({"type_id": np.arange(1, 40), "avg_of_avg_price": rng.uniform(1, 1000, 39),
+                            "avg_daily_volume": rng.uniform(0, 50, 39)})
+    env = {"book": book}
+
+    monkeypatch.setattr(ms, "watchlist", watchlist, raising=False)
+    monkeypatch.setattr(ms, "read_sql_watchlist", lambda: watchlist)
+    monkeypatch.setattr(ms, "read_book_orders", lambda ids: env["book"][env["book"]["type_id"].isin(ids)])
+    monkeypatch.setattr(ms, "read_history_means", lambda: history.copy())
+    monkeypatch.setattr(ms, "get_jita_prices", lambda stats: stats)
+    pd.DataFrame({"type_id": []}).to_sql("Market_Stats", "sqlite:///market_orders.sqlite", if_exists="replace")
+    return env
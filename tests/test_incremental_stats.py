@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+import MarketStructures8 as ms
+import sql_handler
+
+
+def test_incremental_matches_full(stats_env):
+    _, saved, _ = ms.process_orders(None)
+    sql_handler.update_stats(saved)
+
+    # orders change for a few items, including one that loses its bids
+    book = stats_env["book"]
+    changed = [3, 5, 8, 21]
+    book.loc[book["type_id"].isin(changed[:3]), "price"] *= 1.1
+    stats_env["book"] = book[~((book["type_id"] == 21) & book["is_buy_order"])]
+
+    _, incremental, _ = ms.process_orders(None, stats_update={"type_ids": changed})
+    _, full, _ = ms.process_orders(None)
+
+    assert incremental["max_bid"].isna().sum() == 0
+    pd.testing.assert_frame_equal(incremental, full, check_dtype=False)
+
+
+def test_nothing_changed_keeps_saved_stats(stats_env, monkeypatch):
+    _, saved, _ = ms.process_orders(None)
+    sql_handler.update_stats(saved)
+    monkeypatch.setattr(ms, "read_book_orders", lambda ids: pytest.fail("orders read for an empty update"))
+
+    _, kept, _ = ms.process_orders(None, stats_update={"type_ids": []})
+
+    pd.testing.assert_frame_equal(kept, saved, check_dtype=False)
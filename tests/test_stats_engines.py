@@ -0,0 +1,65 @@
+import math
+from fractions import Fraction
+
+import numpy as np
+import pandas as pd
+
+import MarketStructures8 as ms
+from order_stats import buy_cost, weighted_quantiles
+
+
+def test_engines_match(stats_env):
+    _, pandas_stats, _ = ms.process_orders(None)
+    _, polars_stats, _ = ms.process_orders(None, stats_engine="polars")
+
+    # the book has types without bids and types without history (filled with 0 like the saved
+    # stats), so the NaN paths are covered too
+    assert pandas_stats["max_bid"].eq(0).any() and pandas_stats["avg_daily_volume"].eq(0).any()
+    assert {"avg_price_50", "weighted_price_5"} <= set(pandas_stats.columns)
+    pd.testing.assert_frame_equal(polars_stats, pandas_stats)
+
+
+def test_buy_cost(stats_env):
+    sells = stats_env["book"][~stats_env["book"]["is_buy_order"]]
+    # 50 and up have no orders, and 10**6 is more than any type has listed
+    requests = pd.DataFrame([(type_id, quantity) for type_id in range(1, 61) for quantity in [0, 1, 50, 1000, 10**6]],
+                            columns=["type_id", "quantity"])
+
+    result = buy_cost(sells, requests)
+
+    # walk up each type's orders from the cheapest
+    for row in result.itertuples():
+        orders = sells[sells["type_id"] == row.type_id].sort_values("price")
+        left, cost, last = row.quantity, 0.0, np.nan
+        for price, volume in zip(orders["price"], orders["volume_remain"]):
+            if left == 0:
+                break
+            take = min(left, volume)
+            left, cost, last = left - take, cost + take * price, price
+        filled = row.quantity - left
+        assert row.filled == filled
+        assert math.isclose(row.total_cost, cost, rel_tol=1e-12)
+        np.testing.assert_allclose([row.avg_price, row.marginal_price],
+                                   [cost / filled if filled else np.nan, last], rtol=1e-12)
+
+
+def test_weighted_quantiles(stats_env):
+    sells = stats_env["book"][~stats_env["book"]["is_buy_order"]]
+    # plus 100 single units, where 0.07 * 100 comes out a hair over 7 in floating point
+    sells = pd.concat([sells, pd.DataFrame({"type_id": 100, "volume_remain": 1, "price": np.arange(100.0, 0, -1),
+                                            "is_buy_order": False})], ignore_index=True)
+    quantiles = [0.025, 0.05, 0.07, 0.5, 0.95, 1.0]
+
+    result = weighted_quantiles(sells, quantiles)
+
+    assert list(result.columns) == ["type_id", "weighted_price_2_5", "weighted_price_5", "weighted_price_7",
+                                    "weighted_price_50", "weighted_price_95", "weighted_price_100"]
+    assert result["type_id"].tolist() == sorted(sells["type_id"].unique())
+    # one price per unit listed, and the first unit whose rank reaches q of them (inverted_cdf). The
+    # rank is worked out with the decimal value of q, so 0.07 of 100 units is the 7th unit
+    for row in result.itertuples(index=False):
+        orders = sells[sells["type_id"] == row.type_id].sort_values("price")
+        units = np.repeat(orders["price"].to_numpy(), orders["volume_remain"].to_numpy())
+        for quantile, value in zip(quantiles, row[1:]):
+            rank = max(math.ceil(Fraction(str(quantile)) * len(units)), 1)
+            assert value == units[rank - 1]
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+import MarketStructures8 as ms
+import get_jita_prices
+import shared_utils
+
+# the row-wise versions these were vectorised from, to pin the results against
+
+
+def old_days_remaining(final_df: pd.DataFrame) -> pd.Series:
+    days = final_df.apply(
+        lambda row: 0 if row["avg_daily_volume"] == 0 else row["total_volume_remain"] / row["avg_daily_volume"],
+        axis=1
+    )
+    return days.round(1)
+
+
+def old_handle_zero_dates(df: pd.DataFrame) -> pd.DataFrame:
+    df.timestamp = df.timestamp.apply(lambda x: str(x) if x == 0 else x)
+    df = df.sort_values(by='timestamp', ascending=False)
+    ts = df.timestamp[0]
+    df.timestamp = df.timestamp.apply(lambda x: ts if x == str(0) else x)
+    df.timestamp = pd.to_datetime(df.timestamp)
+    return df
+
+
+def test_days_remaining(monkeypatch):
+    merged_orders = pd.DataFrame({
+        "type_id": [1, 2, 3, 4, 5],
+        "total_volume_remain": [100, 50, 30, 0, 7],
+    })
+    # 2 doesn't trade, 3 has no history, 5 divides to x.x5
+    history = pd.DataFrame({
+        "type_id": [1, 2, 4, 5],
+        "avg_of_avg_price": [10.0, 20.0, 30.0, 40.0],
+        "avg_daily_volume": [8.0, 0.0, 3.0, 0.4],
+    })
+    monkeypatch.setattr(ms, "history_merge", lambda: history.copy())
+    monkeypatch.setattr(ms, "watchlist", pd.DataFrame({"type_id": [1, 2, 3, 4, 5],
+                                                       "type_name": list("abcde")}), raising=False)
+
+    final_df = ms.merge_market_stats(merged_orders)
+
+    np.testing.assert_array_equal(final_df["days_remaining"], [12.5, 0.0, np.nan, 0.0, 17.5])
+    pd.testing.assert_series_equal(final_df["days_remaining"], old_days_remaining(final_df),
+                                   check_names=False)
+
+
+def test_handle_zero_dates():
+    df = pd.DataFrame({
+        "timestamp": ["2024-05-02 10:00:00", 0, "2024-05-03 08:30:00", 0, "2024-05-01 00:00:00"],
+        "type_id": [1, 2, 3, 4, 5],
+    })
+
+    result = shared_utils.handle_zero_dates(df.copy())
+
+    expected = old_handle_zero_dates(df.copy())
+    pd.testing.assert_frame_equal(result, expected)
+    # zeros are filled from the row labelled 0
+    assert (result.set_index("type_id").loc[[2, 4], "timestamp"] == pd.Timestamp("2024-05-02 10:00:00")).all()
+
+
+def test_mined_value(monkeypatch, tmp_path):
+    (tmp_path / "data").mkdir()
+    pd.DataFrame({"type_id": [1230, 1228, 18], "Ore": ["Veldspar", "Scordite", "Plagioclase"],
+                  "Qty": [1000, 250, 75]}).to_csv(tmp_path / "data" / "mining_basket.csv", index=False)
+    pd.DataFrame({
+        "type_id": [1230, 1228, 18, 1230, 1228, 18],
+        "price_date": ["2024-05-01"] * 3 + ["2024-05-02"] * 3,
+        "sell_price_avg": [15.37, 22.1, 71.93, 15.41, 21.98, 72.05],
+    }).to_csv(tmp_path / "data" / "mining_basket_history.csv", index=False)
+    monkeypatch.chdir(tmp_path)
+
+    by_day = get_jita_prices.process_market_basket()
+
+    mined = pd.read_csv(tmp_path / "data" / "mined_items_by_day.csv")
+    basket = pd.read_csv(tmp_path / "data" / "mining_basket.csv").rename(columns={"Ore": "ore", "Qty": "qty"})
+    history = pd.read_csv(tmp_path / "data" / "mining_basket_history.csv").merge(basket, on="type_id")
+    expected = history.apply(lambda row: row['sell_price_avg'] * row['qty'], axis=1)
+    np.testing.assert_array_equal(mined["mined_value"], expected)
+    np.testing.assert_array_equal(by_day["mined_value"], expected.groupby(history["price_date"]).sum())